@@ -18,10 +18,11 @@ from captum._utils.typing import (
 
 from pytorch_lightning import Trainer
 from torch.utils.data import DataLoader
-from typing import Any, Callable, Tuple
+from typing import Any, Callable, Tuple, Union
 
 from tint.utils import TensorDataset, _add_temporal_mask, default_collate
 from attrs.gatemasknn import GateMaskNet
+from attrs.mask_optimizer import MaskOptimizer
 
 
 class GateMask(PerturbationAttribution):
@@ -53,7 +54,7 @@ class GateMask(PerturbationAttribution):
         baselines: BaselineType = None,
         target: TargetType = None,
         additional_forward_args: Any = None,
-        trainer: Trainer = None,
+        trainer: Union[Trainer, MaskOptimizer] = None,
         mask_net: GateMaskNet = None,
         batch_size: int = 32,
         temporal_additional_forward_args: Tuple[bool] = None,
@@ -71,10 +72,11 @@ class GateMask(PerturbationAttribution):
         baselines = _format_baseline(baselines, inputs)
         _validate_input(inputs, baselines)
 
-        # Init trainer if not provided
+        # Init trainer if not provided. A Lightning trainer can only fit
+        # once, the MaskOptimizer has no state and is used as it is
         if trainer is None:
-            trainer = Trainer(max_epochs=100)
-        else:
+            trainer = MaskOptimizer(max_epochs=100)
+        elif isinstance(trainer, Trainer):
             trainer = copy.deepcopy(trainer)
 
         # Assert only one input, as the Retain only accepts one
@@ -2,10 +2,7 @@ import torch as th
 import torch.nn as nn
 import numpy as np
 from captum._utils.common import _run_forward
-from sklearn.cluster import KMeans
-import random
 from typing import Callable, Union
-from collections import Counter
 
 from tint.models import Net, MLP
 import warnings
@@ -69,6 +66,7 @@ class GateMaskNN(nn.Module):
         self.T = None
         self.reg_multiplier = None
         self.mask = None
+        self.trendnet = None
         self.based = based
         self.factor_dilation = factor_dilation
         self.pooling_method = pooling_method
@@ -80,6 +78,9 @@ class GateMaskNN(nn.Module):
         self.batch_size = batch_size
         self.win_size = win_size
         self.sigma = sigma
+        # the trend networks only depend on the time and feature dimensions, so a
+        # mask net reused across batches keeps them warm when initialized again
+        new_trendnet = self.trendnet is None or (self.T, self.channels) != tuple(input_size[1:])
         self.channels = input_size[2]
         self.T = input_size[1]
         self.reg_multiplier = np.exp(
@@ -90,9 +91,10 @@ class GateMaskNN(nn.Module):
 
         self.mask = nn.Parameter(th.Tensor(*input_size))
 
-        self.trendnet = nn.ModuleList()
-        for i in range(self.channels):
-            self.trendnet.append(MLP([self.T, 32, self.T], activations='relu'))
+        if new_trendnet:
+            self.trendnet = nn.ModuleList()
+            for i in range(self.channels):
+                self.trendnet.append(MLP([self.T, 32, self.T], activations='relu'))
 
         self.reset_parameters()
 
@@ -256,6 +258,8 @@ class GateMaskNet(Net):
         )
 
         self.preservation_mode = preservation_mode
+        # k-means centroids of the last triplet loss, to warm start the next one
+        self.centroids = None
         self.lambda_1 = lambda_1
         self.lambda_2 = lambda_2
         self.based = based
@@ -335,77 +339,88 @@ class GateMaskNet(Net):
 
         return loss
 
+    def _kmeans(self, points, num_cluster=2, n_iter=5):
+        # a few Lloyd iterations on the device, warm started from the
+        # centroids of the previous step, which are usually close already
+        centroids = self.centroids
+        if centroids is None or centroids.shape != (num_cluster, points.shape[1]) \
+            or centroids.device != points.device:
+            # first centroid at random, each next one the farthest point from the chosen ones
+            centroids = points[th.randint(len(points), (1,), device=points.device)]
+            for _ in range(1, num_cluster):
+                farthest = th.cdist(points, centroids).min(dim=1).values.argmax()
+                centroids = th.cat([centroids, points[farthest].unsqueeze(0)])
+
+        for _ in range(n_iter):
+            one_hot = nn.functional.one_hot(
+                th.cdist(points, centroids).argmin(dim=1), num_cluster
+            ).to(points.dtype)
+            counts = one_hot.sum(dim=0).unsqueeze(1)
+            # an empty cluster keeps its centroid
+            centroids = th.where(
+                counts > 0, one_hot.T @ points / counts.clamp(min=1), centroids
+            )
+
+        self.centroids = centroids
+        distances = th.cdist(points, centroids)
+        return distances.argmin(dim=1), distances.min(dim=1).values
+
+    def _within_cluster_rank(self, labels, keys, counts):
+        # rank of each point by key among the points of its cluster
+        order = keys.argsort()
+        order = order[labels[order].argsort(stable=True)]
+        position = th.empty_like(order)
+        position[order] = th.arange(len(order), device=order.device)
+        return position - (counts.cumsum(0) - counts)[labels]
+
     def _triplet_loss(self, condition):
-        _, ts_dim, num_dim = condition.shape
-        points = condition.reshape(-1, ts_dim * num_dim).detach().cpu().numpy()
+        """
+        Same loss as the sklearn KMeans version of ContraLSP, computed on the device
+        without per sample loops. The anchor of each cluster is its point nearest to
+        the centroid, the positives are the next nearest and the negatives are sampled
+        from the other clusters. Like the original, the distances are computed on the
+        detached condition and the anchor and positives index all points with their
+        positions within the cluster.
+        """
+        points = condition.detach().reshape(len(condition), -1)
+        num_points, num_dim = points.shape
         num_cluster = 2
-        kmeans = KMeans(n_clusters=num_cluster)
-        kmeans.fit(points)
-        cluster_label = kmeans.labels_
-        num_cluster_set = Counter(cluster_label)
-
-        # loss of each cluster
-        loss_cluster = condition.abs().mean()   # placeholder
-        for i in range(num_cluster):
-            if num_cluster_set[i] < 2:
-                continue
-            cluster_i = points[np.where(cluster_label == i)]
-            distance_i = kmeans.transform(cluster_i)[:, i]
-            dist_positive = th.DoubleTensor([1])
-            dist_negative = th.DoubleTensor([1])
-            if num_cluster_set[i] >= 250:
-                num_positive = 50
-            else:
-                num_positive = int(num_cluster_set[i] / 5 + 1)
-
-            # select anchor and positive
-            anchor_positive = np.argpartition(distance_i, num_positive)[:(num_positive + 1)]
-            # torch anchor
-            representation_anc = th.from_numpy(points[anchor_positive[0]])
-            # transfer 1D to 3D
-            representation_anc = th.reshape(representation_anc, (1, 1, np.shape(points)[1]))
-
-            # positive part
-            for l in range(1, num_positive + 1):
-                # torch positive
-                representation_pos = th.from_numpy(points[anchor_positive[l]])
-                # transfer 1D to 3D
-                representation_pos = th.reshape(representation_pos, (1, 1, np.shape(points)[1]))
-                anchor_minus_positive = representation_anc - representation_pos
-                dist_positive += th.norm(anchor_minus_positive, p=1)/np.shape(points)[1]
-            dist_positive = dist_positive / num_positive
-
-            # negative part
-            for k in range(num_cluster):
-                dist_cluster_k_negative = th.DoubleTensor([1])
-                if k == i:
-                    continue
-                else:
-                    # select negative
-                    if num_cluster_set[k] >= 250:
-                        num_negative_cluster_k = 50
-                    else:
-                        num_negative_cluster_k = int(num_cluster_set[k] / 5 + 1)
-
-                    negative_cluster_k = random.sample(range(points[kmeans.labels_ == k][:, 0].size),
-                                                       num_negative_cluster_k)
-                    for j in range(num_negative_cluster_k):
-                        # torch negative
-                        representation_neg = th.from_numpy(points[kmeans.labels_ == k][negative_cluster_k[j]])
-                        # transfer 1D to 3D
-                        representation_neg = th.reshape(representation_neg, (1, 1, np.shape(points)[1]))
-                        anchor_minus_negative = representation_anc - representation_neg
-                        dist_cluster_k_negative += th.norm(anchor_minus_negative, p=1)/np.shape(points)[1]
-
-                dist_cluster_k_negative = dist_cluster_k_negative / num_negative_cluster_k
-                dist_negative += dist_cluster_k_negative
-            dist_negative = dist_negative / (num_cluster - 1)
-            #  loss =  -(margin + positives - negatives)
-            if self.preservation_mode:
-                loss_values = th.max((-dist_positive + dist_negative - 1)[0], th.tensor(0.)) / num_cluster
-            else:
-                loss_values = th.max(-(-dist_positive + dist_negative - 1)[0], th.tensor(0.)) / num_cluster
-            loss_cluster += loss_values
+        labels, distance = self._kmeans(points, num_cluster)
+
+        one_hot = nn.functional.one_hot(labels, num_cluster)
+        counts = one_hot.sum(dim=0)
+        # number of positives per cluster, also the number of negatives sampled from it
+        num_samples = th.where(counts >= 250, 50, th.div(counts, 5, rounding_mode='floor') + 1)
+
+        # anchor (rank 0) and positives (rank 1 to num_samples) by distance to the centroid
+        rank = self._within_cluster_rank(labels, distance, counts)
+        local_index = (one_hot.cumsum(dim=0) * one_hot).sum(dim=1) - 1
+        anchor_index = th.zeros(num_cluster, dtype=th.long, device=points.device).index_put_(
+            (labels, ), th.where(rank == 0, local_index, 0), accumulate=True
+        )
+        positive = th.zeros((num_cluster, num_points), device=points.device).index_put_(
+            (labels, local_index), ((rank >= 1) & (rank <= num_samples[labels])).float(), 
+            accumulate=True
+        )
+        # random negatives of each cluster
+        rank = self._within_cluster_rank(labels, th.rand(num_points, device=points.device), counts)
+        negative = one_hot.T * (rank < num_samples[labels])
+
+        # L1 distance of each anchor to all points
+        anchor_distance = th.cdist(points[anchor_index], points, p=1) / num_dim
+
+        # the sums start at 1, as in the original
+        dist_positive = (1 + (anchor_distance * positive).sum(dim=1)) / num_samples
+        dist_cluster_negative = (1 + anchor_distance @ negative.T.to(points.dtype)) / num_samples
+        other_clusters = 1 - th.eye(num_cluster, device=points.device)
+        dist_negative = (1 + (dist_cluster_negative * other_clusters).sum(dim=1)) / (num_cluster - 1)
+
+        #  loss =  -(margin + positives - negatives)
+        margin = -dist_positive + dist_negative - 1
+        if not self.preservation_mode: margin = -margin
+        loss_values = margin.clamp(min=0) / num_cluster
+        # clusters with less than 2 points are skipped
+        loss_cluster = condition.abs().mean() + (loss_values * (counts >= 2)).sum()
 
         return loss_cluster
 
@@ -0,0 +1,95 @@
+import math
+import torch as th
+from torch.utils.data import DataLoader
+
+
+def _to_device(batch, device):
+    return [
+        x.to(device) if isinstance(x, th.Tensor) else x for x in batch
+    ]
+
+
+class MaskOptimizer:
+    """
+    Plain torch replacement of the Lightning Trainer for fitting the mask
+    networks of DynaMask, ExtremalMask and GateMask. It has the fit and predict
+    methods the explainers call, so it can be passed as their trainer, without
+    the callback, logging and accelerator setup of a Trainer for every batch.
+    The mask network is trained on the device of the data, so the same code
+    runs on cpu and gpu. It has no state between fits, so it doesn't need to
+    be copied for every batch like a Trainer.
+
+    Args:
+        max_epochs: max training epochs.
+        patience: stop when the train loss of the last step hasn't improved
+            for this many epochs, like the EarlyStopping('train_loss') callback.
+            Never stops early if None.
+        compile: compile the masked forward of the mask network with torch.compile.
+            The compiled forward is kept on the mask network, so reusing the
+            network across batches doesn't compile it again.
+    """
+
+    def __init__(
+        self, max_epochs: int = 100, patience: int = None, compile: bool = False
+    ) -> None:
+        self.max_epochs = max_epochs
+        self.patience = patience
+        self.compile = compile
+
+    def _setup(self, mask_net, dataloader: DataLoader):
+        # the data decides the device, the first tensor of the dataset is the input
+        device = dataloader.dataset.tensors[0].device
+        mask_net.to(device)
+
+        if self.compile and not getattr(mask_net, "compiled", False):
+            # random ops draw the same numbers as in eager mode, so
+            # compiling doesn't change the gatemask noise
+            th._inductor.config.fallback_random = True
+            mask_net.forward = th.compile(mask_net.forward, dynamic=True)
+            mask_net.compiled = True
+        return device
+
+    def fit(self, mask_net, train_dataloaders: DataLoader) -> None:
+        device = self._setup(mask_net, train_dataloaders)
+        mask_net.train()
+
+        optim = mask_net.configure_optimizers()
+        if isinstance(optim, dict):
+            optim = optim["optimizer"]
+
+        best_loss, wait = th.inf, 0
+        for _ in range(self.max_epochs):
+            for batch_idx, batch in enumerate(train_dataloaders):
+                # same as training_step without logging. Lightning 2 doesn't call
+                # training_step_end, so it isn't called here either
+                loss = mask_net.step(
+                    _to_device(batch, device), batch_idx, stage="train"
+                )
+                optim.zero_grad()
+                loss.backward()
+                optim.step()
+
+            mask_net.on_train_epoch_end()
+
+            if self.patience is None:
+                continue
+            # the early stopping monitors the loss of the last step of the epoch
+            loss = loss.item()
+            if not math.isfinite(loss):
+                break
+            if loss < best_loss:
+                best_loss, wait = loss, 0
+            else:
+                wait += 1
+                if wait >= self.patience:
+                    break
+
+    def predict(self, mask_net, dataloaders: DataLoader) -> list:
+        device = self._setup(mask_net, dataloaders)
+        mask_net.eval()
+
+        with th.no_grad():
+            return [
+                mask_net.predict_step(_to_device(batch, device), batch_idx)
+                for batch_idx, batch in enumerate(dataloaders)
+            ]
@@ -1,9 +1,10 @@
-import torch, gc, copy
+import torch, copy
 
 from typing import Any, Tuple, Union
 from utils.tools import normalize_scale
 from captum.attr import IntegratedGradients
 from exp.exp_basic import dual_input_users
+from utils.explainer import gradient_attr_all_targets
 
 class TSR:
     def __init__(self, model, args):
@@ -26,45 +27,29 @@ class TSR:
             
         attr_original = self.compute_grads(inputs, additional_forward_args, baselines)
             
-        with torch.no_grad():
-            time_relevance_score = []
-            for input_index in range(len(inputs)):
-                cloned = inputs[input_index].clone()
-                batch_size, n_output, seq_len, n_features = attr_original[input_index].shape
-                score = torch.zeros(
-                    (batch_size * n_output, seq_len), device=inputs[input_index].device
-                )
-                
-                if self.args.model not in dual_input_users and input_index > 0:
-                    time_relevance_score.append(score)
-                    continue
-                
-                assignment = inputs[input_index][0, 0, 0]
-                
-                for t in range(inputs[input_index].shape[1]):
-                    prev_value = cloned[:, t]
-                    cloned[:, t] = assignment
-                    
-                    inputs_hat = []
-                    for i in range(len(inputs)):
-                        if i == input_index:
-                            inputs_hat.append(cloned)
-                        else:
-                            inputs_hat.append(inputs[i])
-                
-                    attr_perturbed = self.compute_grads(tuple(inputs_hat), additional_forward_args, baselines)
-                    
-                    for i in range(0, len(attr_perturbed)):
-                        attr_diff = abs(attr_perturbed[i] - attr_original[i])
-                        score[:, t] += torch.sum(attr_diff, dim=(2, 3)).flatten()
-                    
-                    cloned[:, t] = prev_value
-                    
-                    del attr_perturbed, attr_diff
-                    gc.collect()
-                
+        time_relevance_score = []
+        for input_index in range(len(inputs)):
+            batch_size, n_output, seq_len, n_features = attr_original[input_index].shape
+            score = torch.zeros(
+                (batch_size, n_output, seq_len), device=inputs[input_index].device
+            )
+            
+            if self.args.model not in dual_input_users and input_index > 0:
                 time_relevance_score.append(score)
-                del cloned
+                continue
+            
+            # one perturbed copy for each (sample, time step)
+            sample_index, time_index = torch.meshgrid(
+                torch.arange(batch_size, device=score.device), 
+                torch.arange(seq_len, device=score.device), indexing='ij'
+            )
+            sample_index, time_index = sample_index.flatten(), time_index.flatten()
+            
+            score[sample_index, :, time_index] = self.perturbed_grads_diff(
+                inputs, additional_forward_args, baselines, attr_original,
+                input_index, sample_index, time_index
+            )
+            time_relevance_score.append(score)
         
         # time_relevance_score shape will be ((N x O) x seq_len) after summation
         time_relevance_score = tuple(
@@ -82,12 +67,90 @@ class TSR:
             return time_relevance_score
         else: return time_relevance_score[0]
         
+    def perturbed_grads_diff(
+        self, inputs, additional_forward_args, baselines, attr_original,
+        input_index, sample_index, time_index, feature_index=None
+    ):
+        """
+        Perturbs one cell of inputs[input_index] per (sample, time step, feature)
+        and returns the sum of absolute attribution differences from the original.
+        All perturbed copies are stacked along the batch dimension and processed
+        in chunks of args.perturbation_batch_size.
+        
+        Returns: n_perturbations x n_output
+        """
+        batch_size = inputs[0].shape[0]
+        assignment = inputs[input_index][0, 0, 0]
+        chunk_size = self.args.perturbation_batch_size
+        
+        diff = []
+        for start in range(0, len(sample_index), chunk_size):
+            samples = sample_index[start:start+chunk_size]
+            times = time_index[start:start+chunk_size]
+            rows = torch.arange(len(samples), device=samples.device)
+            
+            inputs_hat = [input[samples] for input in inputs]
+            if feature_index is None:
+                inputs_hat[input_index][rows, times] = assignment
+            else:
+                inputs_hat[input_index][rows, times, feature_index[start:start+chunk_size]] = assignment
+            
+            expanded_baselines = tuple(
+                baseline[samples] if isinstance(baseline, torch.Tensor) 
+                and baseline.shape[0] == batch_size else baseline
+                for baseline in baselines
+            )
+            if additional_forward_args is not None:
+                expanded_additional_forward_args = tuple(
+                    arg[samples] if isinstance(arg, torch.Tensor) 
+                    and len(arg.shape) > 0 and arg.shape[0] == batch_size else arg
+                    for arg in additional_forward_args
+                )
+            else: expanded_additional_forward_args = None
+            
+            attr_perturbed = self.compute_grads(
+                tuple(inputs_hat), expanded_additional_forward_args, expanded_baselines
+            )
+            
+            with torch.no_grad():
+                diff.append(sum(
+                    torch.sum(abs(perturbed - original[samples]), dim=(2, 3))
+                    for original, perturbed in zip(attr_original, attr_perturbed)
+                ))
+            del attr_perturbed, inputs_hat
+            
+        return torch.cat(diff, dim=0)
+        
     def compute_grads(self, inputs,additional_forward_args, baselines):
         attr_list = []
         if self.args.task_name == 'classification':
             targets = self.args.num_class
         else: targets = self.args.pred_len
         
+        if self.args.vectorize_targets:
+            # these models use the multiple inputs in the forward function
+            if type(inputs) == tuple and self.args.model not in dual_input_users:
+                new_additional_forward_args = tuple([
+                    input for input in inputs[1:]
+                ])
+                if additional_forward_args is not None:
+                    new_additional_forward_args += additional_forward_args
+                    
+                attr = gradient_attr_all_targets(
+                    'integrated_gradients', self.explainer.forward_func,
+                    inputs[0], baselines[0], new_additional_forward_args, targets
+                )
+                return tuple([attr] + [
+                    torch.zeros(
+                        (inputs[i].shape[0], targets) + inputs[i].shape[1:], 
+                        device=inputs[i].device) for i in range(1, len(inputs))]
+                )
+            
+            return gradient_attr_all_targets(
+                'integrated_gradients', self.explainer.forward_func,
+                inputs, baselines, additional_forward_args, targets
+            )
+        
         for target in range(targets):
             # temporary speedup
             # if target > 0:
@@ -154,59 +217,39 @@ class TSR:
             score > torch.quantile(score, threshold, dim=1, keepdim=True) for score in time_relevance_score
         )
         
-        with torch.no_grad():
-            feature_relevance_score = []
-            for input_index in range(len(inputs)):
-                batch_size, n_output, seq_len, n_features = attr_original[input_index].shape
-                score = torch.zeros(
-                    (batch_size * n_output, seq_len, n_features), 
-                    device=inputs[input_index].device
+        feature_relevance_score = []
+        for input_index in range(len(inputs)):
+            batch_size, n_output, seq_len, n_features = attr_original[input_index].shape
+            score = torch.zeros(
+                (batch_size, n_output, seq_len, n_features), 
+                device=inputs[input_index].device
+            )
+            
+            if self.args.model not in dual_input_users and input_index>0:
+                feature_relevance_score.append(score.reshape((-1, seq_len, n_features)))
+                continue
+            
+            # cells whose time step is below the threshold for all outputs
+            # are zeroed out in the final attribution, so they aren't perturbed
+            above_threshold = is_above_threshold[input_index].reshape(
+                (batch_size, n_output, seq_len)
+            ).any(dim=1)
+            sample_index, time_index = above_threshold.nonzero(as_tuple=True)
+            
+            # one perturbed copy for each (sample, time step, feature)
+            sample_index = sample_index.repeat_interleave(n_features)
+            time_index = time_index.repeat_interleave(n_features)
+            feature_index = torch.arange(
+                n_features, device=score.device
+            ).repeat(len(sample_index) // n_features)
+            
+            if len(sample_index) > 0:
+                score[sample_index, :, time_index, feature_index] = self.perturbed_grads_diff(
+                    inputs, additional_forward_args, baselines, attr_original,
+                    input_index, sample_index, time_index, feature_index
                 )
                 
-                if self.args.model not in dual_input_users and input_index>0:
-                    feature_relevance_score.append(score)
-                    continue
-                
-                cloned = inputs[input_index].clone()
-                assignment = inputs[input_index][0, 0, 0]
-                for t in range(seq_len):
-                    #TODO: revise
-                    above_threshold = is_above_threshold[input_index][:, t]
-
-                    for f in range(n_features):
-                        # if not above_threshold.any():
-                        #     score[:, t] = 0.1
-                        #     continue
-                        
-                        cloned = inputs[input_index].clone()
-                        cloned[:, t, f] = assignment
-                        
-                        inputs_hat = []
-                        for i in range(len(inputs)):
-                            if i == input_index:
-                                inputs_hat.append(cloned)
-                            else:
-                                inputs_hat.append(inputs[i])
-                        
-                        attr_perturbed = self.compute_grads(
-                            tuple(inputs_hat), additional_forward_args, baselines
-                        )
-
-                        # cloned[:, t, f] = prev_value
-                        # right now only the first element in the tuple is used
-                        for original, perturbed in zip(attr_original, attr_perturbed):
-                            diff = abs(perturbed - original)
-                            score[:, t, f] += torch.sum(diff, dim=(2, 3)).flatten()
-                            
-                        # score[~above_threshold, t] = 0.1
-                        del attr_perturbed
-                        gc.collect()
-                        
-                    # normalize across the feature dimension
-                    # score = normalize_scale(score, dim=0, norm_type="minmax")
-                    
-                feature_relevance_score.append(score)
-                del cloned
+            feature_relevance_score.append(score.reshape((-1, seq_len, n_features)))
             
         time_relevance_score = tuple(
             tsr.reshape(input.shape[:2] + (1,) * len(input.shape[2:]))
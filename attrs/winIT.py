@@ -1,4 +1,4 @@
-import torch, gc
+import torch
 import numpy as np
 from captum._utils.typing import (
     BaselineType,
@@ -63,14 +63,27 @@ class WinIT:
         
         raise Exception(f"unknown metric. {self.metric}")
     
-    def generate_counterfactuals(self, batch_size, input_index, feature_index):
+    def generate_counterfactuals(self, batch_size, input_index, n_features):
+        """
+        Draws the counterfactuals of all features in one sampling call. This 
+        consumes the random stream in the same order as drawing them feature by feature.
+        
+        Returns: n_features x batch_size x seq_len
+        """
         if input_index is None:
-            choices = self.data[:, :, feature_index].reshape(-1)
+            data = self.data
         else:
-            choices = self.data[input_index][:][:, :, feature_index].reshape(-1)
-
-        sampled_index = np.random.choice(range(len(choices)), size=(batch_size*self.seq_len))
-        samples = choices[sampled_index].reshape((batch_size, self.seq_len))
+            data = self.data[input_index]
+        
+        # n_features x (n_samples x seq_len)
+        choices = data.permute(2, 0, 1).reshape((n_features, -1))
+        sampled_index = np.random.choice(
+            choices.shape[1], size=(n_features, batch_size*self.seq_len)
+        )
+        sampled_index = torch.from_numpy(sampled_index).to(choices.device)
+        samples = torch.gather(choices, 1, sampled_index).reshape(
+            (n_features, batch_size, self.seq_len)
+        )
         
         return samples
     
@@ -106,40 +119,61 @@ class WinIT:
                     batch_size, y_original.shape[1], seq_len, n_features
                 ), device=inputs[input_index].device)
             
-                for feature in range(n_features):
-                    #TODO: do without cloning
-                    cloned = inputs[input_index].clone()
+                #TODO: use baselines
+                counterfactuals = self.generate_counterfactuals(
+                    batch_size, None if len(inputs) == 1 else input_index, n_features
+                )
+                
+                # each (feature, t) pair masks the last seq_len - t time steps of 
+                # that feature. Pairs are stacked along the batch dimension
+                feature_index, time_index = torch.meshgrid(
+                    torch.arange(n_features), torch.arange(seq_len), indexing='ij'
+                )
+                feature_index, time_index = feature_index.flatten(), time_index.flatten()
+                pairs_per_chunk = max(1, self.args.perturbation_batch_size // batch_size)
+                
+                for start in range(0, len(feature_index), pairs_per_chunk):
+                    features = feature_index[start:start+pairs_per_chunk].to(iS_array.device)
+                    times = time_index[start:start+pairs_per_chunk].to(iS_array.device)
+                    n_pairs = len(features)
+                    
+                    # n_pairs x 1 x seq_len x n_features
+                    mask = (
+                        torch.arange(seq_len, device=iS_array.device).reshape((1, -1, 1)) >= times.reshape((-1, 1, 1))
+                    ) & (
+                        torch.arange(n_features, device=iS_array.device).reshape((1, 1, -1)) == features.reshape((-1, 1, 1))
+                    )
+                    
+                    # (n_pairs x batch_size) x seq_len x n_features
+                    cloned = torch.where(
+                        mask.unsqueeze(1), counterfactuals[features].unsqueeze(-1), 
+                        inputs[input_index].unsqueeze(0)
+                    ).reshape((-1, seq_len, n_features))
+                    
+                    inputs_hat = []
+                    for i in range(len(inputs)):
+                        if i == input_index: inputs_hat.append(cloned)
+                        else: inputs_hat.append(torch.cat([inputs[i]] * n_pairs, dim=0))
+                    expanded_args = tuple(
+                        torch.cat([arg] * n_pairs, dim=0) 
+                        if isinstance(arg, torch.Tensor) else arg
+                        for arg in additional_forward_args
+                    )
+                    
+                    y_perturbed = self.format_output(
+                        model(*tuple(inputs_hat), *expanded_args)
+                    )
                     
-                    #TODO: use baselines
-                    if len(inputs) == 1:
-                        counterfactuals = self.generate_counterfactuals(
-                            batch_size, None, feature
-                        )
-                    else:
-                        counterfactuals = self.generate_counterfactuals(
-                            batch_size, input_index, feature
-                        )
+                    iSab = self._compute_metric(
+                        torch.cat([y_original] * n_pairs, dim=0), y_perturbed
+                    )
+                    iSab = torch.clip(iSab, -1e6, 1e6)
+                    # n_pairs x batch_size x n_output -> batch_size x n_output x n_pairs
+                    iS_array[:, :, times, features] = iSab.reshape(
+                        (n_pairs, batch_size, -1)
+                    ).permute(1, 2, 0)
                     
-                    for t in range(seq_len)[::-1]:
-                        # mask last t timesteps
-                        cloned[:, t, feature] = counterfactuals[:, t]
-                        
-                        inputs_hat = []
-                        for i in range(len(inputs)):
-                            if i == input_index: inputs_hat.append(cloned)
-                            else: inputs_hat.append(inputs[i])
-                        
-                        y_perturbed = self.format_output(
-                            model(*tuple(inputs_hat), *additional_forward_args)
-                        )
-                        
-                        iSab = self._compute_metric(y_original, y_perturbed)
-                        iSab = torch.clip(iSab, -1e6, 1e6)
-                        iS_array[:, :, t, feature] = iSab
-                        
-                        del y_perturbed, inputs_hat
-                    del cloned, counterfactuals
-                    gc.collect()
+                    del y_perturbed, inputs_hat, cloned
             
                 # batch_size, n_output, seq_len, n_features        
                 iS_array[:, :, 1:] -= iS_array[:, :, :-1] 
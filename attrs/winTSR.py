@@ -97,6 +97,11 @@ class WinTSR(Occlusion):
         is_above_threshold = tuple(
             score > torch.quantile(score, threshold, dim=-1, keepdim=True) for score in time_relevance_score
         )
+        # rank of each time step among the ones above the threshold in its sample,
+        # computed once instead of for every ablated feature
+        above_threshold_rank = tuple(
+            is_above.long().cumsum(dim=-1) - 1 for is_above in is_above_threshold
+        )
         
         # Formatting strides
         strides = _format_and_verify_strides(strides, inputs)
@@ -154,6 +159,7 @@ class WinTSR(Occlusion):
             sliding_window_tensors=sliding_window_tensors,
             shift_counts=tuple(shift_counts),
             is_above_threshold=is_above_threshold,
+            above_threshold_rank=above_threshold_rank,
             strides=strides,
             attributions_fn=abs,
             show_progress=show_progress,
@@ -244,19 +250,15 @@ class WinTSR(Occlusion):
         being 1. This mask contains 1s in locations which have been ablated (and
         thus counted towards ablations for that feature) and 0s otherwise.
         """
-        input_mask = torch.stack(
-            [
-                self._occlusion_mask(
-                    expanded_input,
-                    j,
-                    kwargs["sliding_window_tensors"],
-                    kwargs["strides"],
-                    kwargs["shift_counts"],
-                    kwargs.get("is_above_threshold", None),
-                )
-                for j in range(start_feature, end_feature)
-            ],
-            dim=0,
+        input_mask = self._occlusion_masks(
+            expanded_input,
+            start_feature,
+            end_feature,
+            kwargs["sliding_window_tensors"],
+            kwargs["strides"],
+            kwargs["shift_counts"],
+            kwargs.get("is_above_threshold", None),
+            kwargs.get("above_threshold_rank", None),
         ).long()
         # print('Expanded input ', expanded_input.shape, input_mask.shape, f' Start {start_feature}, end {end_feature}')
         
@@ -298,65 +300,86 @@ class WinTSR(Occlusion):
         is_above_threshold: Tensor = None,
     ) -> Tensor:
         """
-        This constructs the current occlusion mask, which is the appropriate
-        shift of the sliding window tensor based on the ablated feature number.
-        The feature number ranges between 0 and the product of the shift counts
-        (# of times the sliding window should be shifted in each dimension).
-        First, the ablated feature number is converted to the number of steps in
-        each dimension from the origin, based on shift counts. This procedure
-        is similar to a base conversion, with the position values equal to shift
-        counts. The feature number is first taken modulo shift_counts[0] to
-        get the number of shifts in the first dimension (each shift
-        by shift_count[0]), and then divided by shift_count[0].
-        The procedure is then continued for each element of shift_count. This
-        computes the total shift in each direction for the sliding window.
-        We then need to compute the padding required after the window in each
-        dimension, which is equal to the total input dimension minus the sliding
-        window dimension minus the (left) shift amount. We construct the
-        array pad_values which contains the left and right pad values for each
-        dimension, in reverse order of dimensions, starting from the last one.
-        Once these padding values are computed, we pad the sliding window tensor
-        of 1s with 0s appropriately, which is the corresponding mask,
-        and the result will match the input shape.
+        The occlusion mask of a single ablated feature number, see _occlusion_masks.
+        """
+        return self._occlusion_masks(
+            expanded_input, ablated_feature_num, ablated_feature_num + 1,
+            sliding_window_tsr, strides, shift_counts, is_above_threshold
+        )[0]
+
+    def _occlusion_masks(
+        self,
+        expanded_input: Tensor,
+        start_feature: int,
+        end_feature: int,
+        sliding_window_tsr: Tensor,
+        strides: Union[int, Tuple[int, ...]],
+        shift_counts: Tuple[int, ...],
+        is_above_threshold: Tensor = None,
+        above_threshold_rank: Tensor = None,
+    ) -> Tensor:
+        """
+        This constructs the occlusion masks of the ablated feature numbers in
+        [start_feature, end_feature) at once, stacked on the first dimension.
+        Each mask is the appropriate shift of the sliding window tensor based on
+        the ablated feature number. Like Occlusion._occlusion_mask, the feature
+        number is converted to the number of steps in each dimension from the
+        origin by a base conversion with the shift counts. The window covers
+        the elements between the shift and the shift plus the window size in
+        each dimension, which is the sliding window tensor of 1s padded with 0s.
+
+        On the temporal dimension, the shift counts the time steps above the
+        threshold of each sample. So the window covers the time steps whose rank
+        among the ones above the threshold is within the shift, and the mask
+        is applied on the other time steps above the threshold.
         """
+        features = range(start_feature, end_feature)
         if is_above_threshold is None:
-            return super()._occlusion_mask(
-                expanded_input=expanded_input,
-                ablated_feature_num=ablated_feature_num,
-                sliding_window_tsr=sliding_window_tsr,
-                strides=strides,
-                shift_counts=shift_counts,
-            )
+            return torch.stack([
+                Occlusion._occlusion_mask(
+                    self, expanded_input, j, sliding_window_tsr, strides, shift_counts
+                ) for j in features
+            ])
+
+        device = expanded_input.device
+        feature_nums = torch.arange(start_feature, end_feature, device=device)
+        strides = strides if isinstance(strides, tuple) else (strides, ) * len(shift_counts)
 
-        # We first compute the hyper-rectangle on the non-temporal dims
-        padded_tensor = super()._occlusion_mask(
-            expanded_input=expanded_input[:, :, 0],
-            ablated_feature_num=ablated_feature_num,
-            sliding_window_tsr=torch.ones(sliding_window_tsr.shape[1:]),
-            strides=strides[1:] if isinstance(strides, tuple) else strides,
-            shift_counts=shift_counts[1:],
-        ).to(expanded_input.device)
+        # We first compute the hyper-rectangles on the non-temporal dims,
+        # n_features x non-temporal dims
+        padded_tensor = torch.ones((len(features), ) + expanded_input.shape[3:], device=device)
+        remaining_total = feature_nums
+        for dim, size in enumerate(expanded_input.shape[3:]):
+            current_index = (remaining_total % shift_counts[dim + 1]) * strides[dim + 1]
+            remaining_total = remaining_total // shift_counts[dim + 1]
+
+            position = torch.arange(size, device=device)
+            inside = (position >= current_index.unsqueeze(1)) & (
+                position < (current_index + sliding_window_tsr.shape[dim + 1]).unsqueeze(1)
+            )
+            padded_tensor = padded_tensor * inside.reshape(
+                (len(features), ) + (1, ) * dim + (size, ) + (1, ) * (padded_tensor.dim() - dim - 2)
+            )
 
         # We get the current index and batch size
         bsz = expanded_input.shape[1]
-        shift_count = shift_counts[0]
-        stride = strides[0] if isinstance(strides, tuple) else strides
-        current_index = (ablated_feature_num % shift_count) * stride
+        current_index = (feature_nums % shift_counts[0]) * strides[0]
+        if above_threshold_rank is None:
+            above_threshold_rank = is_above_threshold.long().cumsum(dim=-1) - 1
 
         # On the temporal dim, the hyper-rectangle is only applied on
-        # non-zeros elements
-        is_above = is_above_threshold.clone()
-        for batch_idx in range(bsz):
-            nonzero = is_above_threshold[batch_idx].nonzero()[:, 0]
-            is_above[
-                batch_idx,
-                nonzero[
-                    current_index : current_index + sliding_window_tsr.shape[0]
-                ],
-            ] = 0
-
-        current_mask = is_above.unsqueeze(-1) * padded_tensor.unsqueeze(0)
-        # print('Mask shape ', current_mask.shape)
+        # non-zeros elements, n_features x batch x seq_len
+        rank = above_threshold_rank.unsqueeze(0)
+        current_index = current_index.reshape((-1, 1, 1))
+        in_window = is_above_threshold.unsqueeze(0) & (rank >= current_index) & (
+            rank < current_index + sliding_window_tsr.shape[0]
+        )
+        # only the samples of the batch are shifted
+        in_window[:, bsz:] = False
+        is_above = is_above_threshold.unsqueeze(0) & ~in_window
+
+        current_mask = is_above.reshape(is_above.shape + (1, ) * (padded_tensor.dim() - 1)) \
+            * padded_tensor.unsqueeze(1).unsqueeze(1)
         return current_mask
 
     def _run_forward(
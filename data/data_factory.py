@@ -1,6 +1,7 @@
+import copy, torch
 from data.data_loader import Dataset_Custom, Dataset_Pred, MultiTimeSeries, UEAloader, MimicIII
-from torch.utils.data import DataLoader
-from data.uea import collate_fn
+from torch.utils.data import DataLoader, BatchSampler, RandomSampler, SequentialSampler
+from data.uea import collate_fn, PrecollatedDataset
 
 data_dict = {
     'custom': Dataset_Custom,
@@ -24,8 +25,8 @@ def data_provider(args, flag):
     freq = args.freq
     
     if args.task_name == 'classification':
+        # only the train split is shuffled, so evaluation batches are always the same samples
         drop_last = False
-        shuffle_flag = True
         
         if args.data == 'UEA':
             data_set = Data(
@@ -40,14 +41,24 @@ def data_provider(args, flag):
             )
             
         print(flag, len(data_set))
-        data_loader = DataLoader(
-            data_set,
-            batch_size=batch_size,
-            shuffle=shuffle_flag,
-            num_workers=args.num_workers,
-            drop_last=drop_last,
-            collate_fn=lambda x: collate_fn(x, max_len=args.seq_len)
-        )
+        if getattr(data_set, 'fixed_length', False):
+            # collated once, the loader fetches whole batches of the stacked tensors
+            sampler = RandomSampler(data_set) if shuffle_flag else SequentialSampler(data_set)
+            data_loader = DataLoader(
+                PrecollatedDataset(data_set, max_len=args.seq_len),
+                sampler=BatchSampler(sampler, batch_size, drop_last),
+                batch_size=None,
+                num_workers=args.num_workers
+            )
+        else:
+            data_loader = DataLoader(
+                data_set,
+                batch_size=batch_size,
+                shuffle=shuffle_flag,
+                num_workers=args.num_workers,
+                drop_last=drop_last,
+                collate_fn=lambda x: collate_fn(x, max_len=args.seq_len)
+            )
     else:
         # long term forecast
         data_set = Data(
@@ -69,3 +80,91 @@ def data_provider(args, flag):
             drop_last=drop_last
         )
     return data_set, data_loader
+
+
+class DeviceTensorLoader:
+    """
+    Serves the batches of a dataloader from tensors materialized once, in the 
+    sequential order of the dataset. Batches are slices of contiguous float32 
+    tensors, either already on the device or pinned and copied asynchronously.
+    Meant for the small splits that are iterated many times during interpretation.
+    
+    Args:
+        dataloader: the dataloader to materialize, its dataset and batch size are kept.
+        device: where the tensors are kept, or copied to when pinned.
+        pin_memory: keep the tensors in pinned host memory instead of on the device.
+    """
+    def __init__(self, dataloader, device, pin_memory=False):
+        self.dataset = dataloader.dataset
+        self.device = torch.device(device)
+        self.pin_memory = pin_memory and self.device.type == 'cuda'
+        self.num_workers = 0
+        
+        dataloader = sequential_loader(dataloader)
+        if dataloader.batch_size is None:
+            # indexed by whole batches, see PrecollatedDataset
+            self.batch_size = dataloader.sampler.batch_size
+            tensors = self.dataset[list(range(len(self.dataset)))]
+        else:
+            self.batch_size = dataloader.batch_size
+            tensors = [torch.cat(items) for items in zip(*dataloader)]
+        
+        self.tensors = []
+        for tensor in tensors:
+            if tensor.is_floating_point(): tensor = tensor.float()
+            tensor = tensor.contiguous()
+            if self.pin_memory: tensor = tensor.pin_memory()
+            else: tensor = tensor.to(self.device)
+            self.tensors.append(tensor)
+        
+        # batch range served, changed by shard
+        self.start, self.end = 0, (len(self.dataset) + self.batch_size - 1) // self.batch_size
+    
+    def shard(self, start, end):
+        # same tensors, only serves the batches in [start, end)
+        loader = copy.copy(self)
+        loader.start, loader.end = self.start + start, self.start + end
+        return loader
+        
+    def __iter__(self):
+        for batch_index in range(self.start, self.end):
+            rows = slice(batch_index * self.batch_size, (batch_index + 1) * self.batch_size)
+            yield tuple(
+                tensor[rows].to(self.device, non_blocking=True) 
+                for tensor in self.tensors
+            )
+            
+    def __len__(self):
+        return self.end - self.start
+
+
+def sequential_loader(dataloader):
+    """Same dataset and batch size as the dataloader, without shuffling or dropping the last batch."""
+    if dataloader.batch_size is None:
+        # indexed by whole batches, see PrecollatedDataset
+        return DataLoader(
+            dataloader.dataset, batch_size=None,
+            sampler=BatchSampler(
+                SequentialSampler(dataloader.dataset), 
+                dataloader.sampler.batch_size, drop_last=False
+            ),
+            num_workers=dataloader.num_workers
+        )
+    
+    return DataLoader(
+        dataloader.dataset, batch_size=dataloader.batch_size, shuffle=False, 
+        num_workers=dataloader.num_workers, collate_fn=dataloader.collate_fn
+    )
+
+
+def interpret_loader(dataloader, args, device):
+    """
+    Loader of the split to interpret. Batches are in the sequential order of the 
+    dataset, so a batch index identifies the same samples across explainers, shards
+    and resumed runs. Wrapped in a DeviceTensorLoader if enabled by args.tensor_loader.
+    """
+    if args.tensor_loader == 'none': return sequential_loader(dataloader)
+    
+    return DeviceTensorLoader(
+        dataloader, device, pin_memory=args.tensor_loader == 'pinned'
+    )
@@ -1,31 +1,48 @@
-import os, re, pickle
+import os, re, pickle, hashlib, shutil, tempfile
 import pandas as pd
 import numpy as np
 import os, torch, glob
 from torch.utils.data import Dataset
 from sklearn.preprocessing import StandardScaler, MinMaxScaler
 from sklearn.model_selection import train_test_split
-from utils.timefeatures import time_features
-from utils.sktime import load_from_tsfile_to_dataframe
-from data.uea import subsample, interpolate_missing, Normalizer
+from utils.timefeatures import encode_time_features
+from utils.sktime import load_from_tsfile_to_arrays, stack_ragged
+from data.uea import subsample, interpolate_missing
 import warnings
 from utils.augmentation import run_augmentation_single
 
 warnings.filterwarnings('ignore')
 
 def add_time_features(dates, timeenc=0, freq='h'):
-    df_stamp = pd.DataFrame()
-    df_stamp['date'] = pd.to_datetime(dates)
-    if timeenc == 0:
-        df_stamp['month'] = df_stamp.date.apply(lambda row: row.month, 1)
-        df_stamp['day'] = df_stamp.date.apply(lambda row: row.day, 1)
-        df_stamp['weekday'] = df_stamp.date.apply(lambda row: row.weekday(), 1)
-        df_stamp['hour'] = df_stamp.date.apply(lambda row: row.hour, 1)
-        data_stamp = df_stamp.drop(['date'], 1).values
-    elif timeenc == 1:
-        data_stamp = time_features(pd.to_datetime(df_stamp['date'].values), freq=freq)
-        data_stamp = data_stamp.transpose(1, 0)
-    return data_stamp
+    # month, day, weekday, hour for timeenc=0, frequency based features for timeenc=1
+    return encode_time_features(dates, timeenc, freq)
+
+def file_hash(filepath, chunk_size=1<<24):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(filepath, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def save_cache(cache_folder, arrays, objects=None):
+    """
+    Saves each array as {name}.npy and each object as {name}.pkl in cache_folder.
+    They are written to a temporary folder first, so other processes never see a partial cache.
+    """
+    objects = objects or {}
+    temp_folder = None
+    try:
+        os.makedirs(os.path.dirname(cache_folder), exist_ok=True)
+        temp_folder = tempfile.mkdtemp(dir=os.path.dirname(cache_folder))
+        for name, array in arrays.items():
+            np.save(os.path.join(temp_folder, f'{name}.npy'), array)
+        for name, obj in objects.items():
+            with open(os.path.join(temp_folder, f'{name}.pkl'), 'wb') as file:
+                pickle.dump(obj, file)
+        os.rename(temp_folder, cache_folder)
+    except OSError:
+        # read only data folder or another process already saved the cache
+        if temp_folder is not None: shutil.rmtree(temp_folder, ignore_errors=True)
 
 class Dataset_Custom(Dataset):
     def __init__(self, root_path, flag='train', size=None,
@@ -57,6 +74,53 @@ class Dataset_Custom(Dataset):
         self.__read_data__()
 
     def __read_data__(self):
+        data, data_stamp = self.__load_cached__()
+        
+        num_train = int(len(data) * 0.8)
+        num_test = int(len(data) * 0.1)
+        num_vali = len(data) - num_train - num_test
+        border1s = [0, num_train - self.seq_len, len(data) - num_test - self.seq_len]
+        border2s = [num_train, num_train + num_vali, len(data)]
+        border1 = border1s[self.set_type]
+        border2 = border2s[self.set_type]
+
+        # select data split
+        self.data_x = data[border1:border2]
+        self.data_y = data[border1:border2]
+        self.data_stamp = data_stamp[border1:border2]
+        
+    def __load_cached__(self):
+        """
+        The scaled data, time stamps and scaler of the whole file are cached in
+        root_path/cache, keyed by the file content and preprocessing settings.
+        All splits, iterations and processes reuse them instead of parsing the csv.
+        """
+        filepath = os.path.join(self.root_path, self.data_path)
+        key = hashlib.blake2b(str((
+            file_hash(filepath), self.features, self.target, 
+            self.scale, self.timeenc, self.freq
+        )).encode(), digest_size=16).hexdigest()
+        cache_folder = os.path.join(
+            self.root_path, 'cache', f"{self.data_path.split('.')[0]}_{key}"
+        )
+        
+        if os.path.exists(cache_folder):
+            with open(os.path.join(cache_folder, 'scaler.pkl'), 'rb') as file:
+                self.scaler = pickle.load(file)
+            return (
+                np.load(os.path.join(cache_folder, 'data.npy'), mmap_mode='r'),
+                np.load(os.path.join(cache_folder, 'data_stamp.npy'), mmap_mode='r')
+            )
+        
+        data, data_stamp = self.__preprocess__()
+        save_cache(
+            cache_folder, {'data': data, 'data_stamp': data_stamp}, 
+            {'scaler': self.scaler}
+        )
+        
+        return data, data_stamp
+    
+    def __preprocess__(self):
         self.scaler = StandardScaler()
         df_raw = pd.read_csv(os.path.join(self.root_path,
                                           self.data_path))
@@ -70,12 +134,6 @@ class Dataset_Custom(Dataset):
         df_raw = df_raw[['date'] + cols + [self.target]]
         # print(cols)
         num_train = int(len(df_raw) * 0.8)
-        num_test = int(len(df_raw) * 0.1)
-        num_vali = len(df_raw) - num_train - num_test
-        border1s = [0, num_train - self.seq_len, len(df_raw) - num_test - self.seq_len]
-        border2s = [num_train, num_train + num_vali, len(df_raw)]
-        border1 = border1s[self.set_type]
-        border2 = border2s[self.set_type]
 
         # choose input data based on Multivariate or Univariate setting
         if self.features == 'M' or self.features == 'MS':
@@ -84,32 +142,17 @@ class Dataset_Custom(Dataset):
         elif self.features == 'S':
             df_data = df_raw[[self.target]]
 
-        # scale data
+        # scale data, fitted on the train split
         if self.scale:
-            train_data = df_data[border1s[0]:border2s[0]]
+            train_data = df_data[0:num_train]
             self.scaler.fit(train_data.values)
             data = self.scaler.transform(df_data.values)
         else:
             data = df_data.values
 
         # add time encoding
-        df_stamp = df_raw[['date']][border1:border2]
-        
-        df_stamp['date'] = pd.to_datetime(df_stamp.date)
-        if self.timeenc == 0:
-            df_stamp['month'] = df_stamp.date.apply(lambda row: row.month, 1)
-            df_stamp['day'] = df_stamp.date.apply(lambda row: row.day, 1)
-            df_stamp['weekday'] = df_stamp.date.apply(lambda row: row.weekday(), 1)
-            df_stamp['hour'] = df_stamp.date.apply(lambda row: row.hour, 1)
-            data_stamp = df_stamp.drop(['date'], 1).values
-        elif self.timeenc == 1:
-            data_stamp = time_features(pd.to_datetime(df_stamp['date'].values), freq=self.freq)
-            data_stamp = data_stamp.transpose(1, 0)
-
-        # select data split
-        self.data_x = data[border1:border2]
-        self.data_y = data[border1:border2]
-        self.data_stamp = data_stamp
+        data_stamp = add_time_features(df_raw['date'].values, self.timeenc, self.freq)
+        return data, data_stamp
 
     def __getitem__(self, index):
         s_begin = index
@@ -198,19 +241,11 @@ class Dataset_Pred(Dataset):
         tmp_stamp['date'] = pd.to_datetime(tmp_stamp.date)
         pred_dates = pd.date_range(tmp_stamp.date.values[-1], periods=self.pred_len + 1, freq=self.freq)
 
-        df_stamp = pd.DataFrame(columns=['date'])
-        df_stamp.date = list(tmp_stamp.date.values) + list(pred_dates[1:])
-        if self.timeenc == 0:
-            df_stamp['month'] = df_stamp.date.apply(lambda row: row.month, 1)
-            df_stamp['day'] = df_stamp.date.apply(lambda row: row.day, 1)
-            df_stamp['weekday'] = df_stamp.date.apply(lambda row: row.weekday(), 1)
-            df_stamp['hour'] = df_stamp.date.apply(lambda row: row.hour, 1)
-            df_stamp['minute'] = df_stamp.date.apply(lambda row: row.minute, 1)
-            df_stamp['minute'] = df_stamp.minute.map(lambda x: x // 15)
-            data_stamp = df_stamp.drop(['date'], 1).values
-        elif self.timeenc == 1:
-            data_stamp = time_features(pd.to_datetime(df_stamp['date'].values), freq=self.freq)
-            data_stamp = data_stamp.transpose(1, 0)
+        stamp_dates = list(tmp_stamp.date.values) + list(pred_dates[1:])
+        # timeenc=0 also has the minute in 15 minute intervals here
+        data_stamp = encode_time_features(
+            stamp_dates, self.timeenc, self.freq, minute=True
+        )
 
         self.data_x = data[border1:border2]
         if self.inverse:
@@ -328,29 +363,37 @@ class MultiTimeSeries(Dataset):
             self.scaler.fit(train_data[selected_columns])
             df_data.loc[:, selected_columns] = self.scaler.transform(df_data[selected_columns])
             
-        # add time encoding
-        data_stamp = self._add_time_features(df_data.loc[0, [self.time_col]])
-        time_encoded_columns = data_stamp.shape[1]
+        # each id's series is stored contiguously, in time order
+        df_data.sort_values(by=[id_col, time_col], kind='stable', inplace=True)
+        self.values = df_data[selected_columns].values.astype(float)
+        
+        # add time encoding, computed once per unique date
+        unique_dates, date_index = np.unique(df_data[time_col].values, return_inverse=True)
+        self.stamps = add_time_features(
+            unique_dates, self.timeenc, self.freq
+        )[date_index].astype(float)
+        time_encoded_columns = self.stamps.shape[1]
         print('Number of time encoded columns :', time_encoded_columns)
         
         print('Getting valid sampling locations.')
+        # ids are sorted, so the first index of each id is its offset
+        _, entity_offsets, entity_lengths = np.unique(
+            df_data[id_col].values, return_index=True, return_counts=True
+        )
+        windows_per_entity = np.maximum(entity_lengths - time_steps + 1, 0)
+        window_offsets = np.cumsum(windows_per_entity) - windows_per_entity
         
-        valid_sampling_locations = []
-        split_data_map = {}
-        for identifier, df in df_data.groupby(id_col):
-            num_entries = len(df)
-            if num_entries >= time_steps:
-                valid_sampling_locations += [
-                    (identifier, i)
-                    for i in range(num_entries - time_steps + 1)
-                ]
-            split_data_map[identifier] = df
+        # (entity_offset, start) of every window, a window never crosses two ids
+        valid_sampling_locations = np.stack([
+            np.repeat(entity_offsets, windows_per_entity), 
+            np.arange(windows_per_entity.sum()) - np.repeat(window_offsets, windows_per_entity)
+        ], axis=1)
 
         max_samples = self.max_samples # -1 takes all samples
         
         if max_samples > 0 and len(valid_sampling_locations) > max_samples:
             print('Extracting {} samples...'.format(max_samples))
-            ranges = [valid_sampling_locations[i] for i in np.random.choice(
+            ranges = valid_sampling_locations[np.random.choice(
                   len(valid_sampling_locations), max_samples, replace=False)]
         else:
             # print('Max samples={} exceeds # available segments={}'.format(
@@ -358,32 +401,25 @@ class MultiTimeSeries(Dataset):
             ranges = valid_sampling_locations
             max_samples = len(valid_sampling_locations)
         
-        self.data = np.zeros((max_samples, self.time_steps, len(selected_columns)))
-        self.data_stamp = np.zeros((max_samples, self.time_steps, time_encoded_columns))
-        for i, tup in enumerate(ranges):
-            if ((i + 1) % 10000) == 0:
-                print(i + 1, 'of', max_samples, 'samples done...')
-            identifier, start_idx = tup
-            sliced = split_data_map[identifier].iloc[start_idx:start_idx + time_steps]
-            self.data[i] = sliced[selected_columns]
-            self.data_stamp[i] = add_time_features(
-                sliced[[self.time_col]], self.timeenc, self.freq
-            )
+        # windows aren't copied, samples are views of the contiguous series
+        self.windows = ranges
         
     def __getitem__(self, index):
-        s_end = self.seq_len
+        entity_offset, start = self.windows[index]
+        s_begin = entity_offset + start
+        s_end = s_begin + self.seq_len
         r_begin = s_end - self.label_len
         r_end = r_begin + self.label_len + self.pred_len
 
-        seq_x = self.data[index][:s_end]
-        seq_y = self.data[index][r_begin:r_end]
+        seq_x = self.values[s_begin:s_end]
+        seq_y = self.values[r_begin:r_end]
         
-        seq_x_mark = self.data_stamp[index][:s_end]
-        seq_y_mark = self.data_stamp[index][r_begin:r_end]
+        seq_x_mark = self.stamps[s_begin:s_end]
+        seq_y_mark = self.stamps[r_begin:r_end]
         return seq_x, seq_y, seq_x_mark, seq_y_mark
 
     def __len__(self):
-        return len(self.data) # - self.seq_len - self.pred_len + 1
+        return len(self.windows) # - self.seq_len - self.pred_len + 1
     
     def inverse_transform(self, data):
         if self.scale:
@@ -398,12 +434,10 @@ class UEAloader(Dataset):
     Argument:
         limit_size: float in (0, 1) for debug
     Attributes:
-        all_df: (num_samples * seq_len, num_columns) dataframe indexed by integer indices, with multiple rows corresponding to the same index (sample).
-            Each row is a time step; Each column contains either metadata (e.g. timestamp) or a feature.
-        feature_df: (num_samples * seq_len, feat_dim) dataframe; contains the subset of columns of `all_df` which correspond to selected features
-        feature_names: names of columns contained in `feature_df` (same as feature_df.columns)
-        all_IDs: (num_samples,) series of IDs contained in `all_df`/`feature_df` (same as all_df.index.unique() )
-        labels_df: (num_samples, num_labels) pd.DataFrame of label(s) for each sample
+        values: (total_seq_len, feat_dim) float32 array of the normalized time steps of all samples, back to back.
+        offsets: (num_samples + 1, ) array, the time steps of sample i are values[offsets[i]:offsets[i+1]].
+        labels: (num_samples, 1) int8 array of the class index of each sample.
+        class_names: names of the classes, in the order of their indices.
         max_seq_len: maximum sequence (time series) length. If None, script argument `max_seq_len` will be used.
             (Moreover, script argument overrides this attribute)
     """
@@ -414,25 +448,23 @@ class UEAloader(Dataset):
         flag = 'TEST' if flag == 'val' else flag.upper()
         self.flag = flag
         
-        self.all_df, self.labels_df = self.load_all(root_path, file_list=file_list, flag=flag)
-        self.all_IDs = self.all_df.index.unique()  # all sample IDs (integer indices 0 ... num_samples-1)
+        values, self.offsets, self.labels = self.load_all(root_path, file_list=file_list, flag=flag)
 
         if limit_size is not None:
             if limit_size > 1:
                 limit_size = int(limit_size)
             else:  # interpret as proportion if in (0, 1]
-                limit_size = int(limit_size * len(self.all_IDs))
-            self.all_IDs = self.all_IDs[:limit_size]
-            self.all_df = self.all_df.loc[self.all_IDs]
-
-        # use all features
-        self.feature_names = self.all_df.columns
-        self.feature_df = self.all_df
-
-        # pre_process
-        normalizer = Normalizer()
-        self.feature_df = normalizer.normalize(self.feature_df)
-        print(len(self.all_IDs))
+                limit_size = int(limit_size * len(self.labels))
+            self.offsets = self.offsets[:limit_size + 1]
+            self.labels = self.labels[:limit_size]
+            values = values[:self.offsets[-1]]
+
+        # pre_process, same as Normalizer standardization across all time steps
+        values = values.astype(np.float64)
+        mean = np.nanmean(values, axis=0)
+        std = np.nanstd(values, axis=0, ddof=1)
+        self.values = ((values - mean) / (std + np.finfo(float).eps)).astype(np.float32)
+        print(len(self.labels))
 
     def load_all(self, root_path, file_list=None, flag=None):
         """
@@ -442,8 +474,9 @@ class UEAloader(Dataset):
             file_list: optionally, provide a list of file paths within `root_path` to consider.
                 Otherwise, entire `root_path` contents will be used.
         Returns:
-            all_df: a single (possibly concatenated) dataframe with all data corresponding to specified files
-            labels_df: dataframe containing label(s) for each sample
+            values: (total_seq_len, feat_dim) array of the time steps of all samples
+            offsets: (num_samples + 1, ) array of where each sample starts in values
+            labels: (num_samples, 1) array containing the label of each sample
         """
         # Select paths for training and evaluation
         if file_list is None:
@@ -459,45 +492,60 @@ class UEAloader(Dataset):
             pattern='*.ts'
             raise Exception("No .ts files found using pattern: '{}'".format(pattern))
 
-        all_df, labels_df = self.load_single(input_paths[0])  # a single file contains dataset
+        return self.load_cached(input_paths[0])  # a single file contains dataset
 
-        return all_df, labels_df
+    def load_cached(self, filepath):
+        """
+        The parsed time steps, offsets and labels are cached in root_path/cache,
+        keyed by the file content, so the .ts file is only parsed once.
+        """
+        cache_folder = os.path.join(
+            os.path.dirname(filepath), 'cache', 
+            f'{os.path.basename(filepath).split(".")[0]}_{file_hash(filepath)}'
+        )
+        names = ['values', 'offsets', 'labels', 'class_names']
+        
+        if os.path.exists(cache_folder):
+            values, offsets, labels, self.class_names = [
+                np.load(os.path.join(cache_folder, f'{name}.npy')) for name in names
+            ]
+            self.max_seq_len = int(np.max(np.diff(offsets)))
+            return values, offsets, labels
+        
+        values, offsets, labels = self.load_single(filepath)
+        save_cache(cache_folder, dict(zip(names, [
+            values, offsets, labels, np.array(self.class_names, dtype=str)
+        ])))
+        return values, offsets, labels
 
     def load_single(self, filepath):
-        df, labels = load_from_tsfile_to_dataframe(filepath, return_separate_X_and_y=True,
-                                                             replace_missing_vals_with='NaN')
+        # the samples are stored back to back, sample i at rows offsets[i]:offsets[i+1]
+        values, offsets, lengths, labels = load_from_tsfile_to_arrays(
+            filepath, replace_missing_vals_with='NaN'
+        )
         labels = pd.Series(labels, dtype="category")
         self.class_names = labels.cat.categories
-        labels_df = pd.DataFrame(labels.cat.codes,
-                                 dtype=np.int8)  # int8-32 gives an error when using nn.CrossEntropyLoss
-
-        lengths = df.applymap(
-            lambda x: len(x)).values  # (num_samples, num_dimensions) array containing the length of each series
-
-        horiz_diffs = np.abs(lengths - np.expand_dims(lengths[:, 0], -1))
-
-        if np.sum(horiz_diffs) > 0:  # if any row (sample) has varying length across dimensions
-            df = df.applymap(subsample)
-
-        lengths = df.applymap(lambda x: len(x)).values
-        vert_diffs = np.abs(lengths - np.expand_dims(lengths[0, :], 0))
-        if np.sum(vert_diffs) > 0:  # if any column (dimension) has varying length across samples
-            self.max_seq_len = int(np.max(lengths[:, 0]))
-        else:
-            self.max_seq_len = lengths[0, 0]
-
-        # First create a (seq_len, feat_dim) dataframe for each sample, indexed by a single integer ("ID" of the sample)
-        # Then concatenate into a (num_samples * seq_len, feat_dim) dataframe, with multiple rows corresponding to the
-        # sample index (i.e. the same scheme as all datasets in this project)
-
-        df = pd.concat((pd.DataFrame({col: df.loc[row, col] for col in df.columns}).reset_index(drop=True).set_index(
-            pd.Series(lengths[row, 0] * [row])) for row in range(df.shape[0])), axis=0)
+        labels = labels.cat.codes.values.astype(np.int8).reshape((-1, 1))  # int8-32 gives an error when using nn.CrossEntropyLoss
+
+        if np.any(lengths != lengths[:, :1]):  # if any row (sample) has varying length across dimensions
+            series = [[
+                subsample(pd.Series(values[offsets[row]:offsets[row] + lengths[row, dim], dim])).values 
+                for row in range(len(lengths))
+            ] for dim in range(lengths.shape[1])]
+            lengths = np.array([[len(x) for x in dim_series] for dim_series in series]).T
+            values, offsets = stack_ragged(
+                [np.concatenate(dim_series) for dim_series in series], lengths
+            )
+        self.max_seq_len = int(np.max(np.diff(offsets)))
 
-        # Replace NaN values
-        grp = df.groupby(by=df.index)
-        df = grp.transform(interpolate_missing)
+        # Replace NaN values, only in the series that have them
+        rows, dims = np.nonzero(np.isnan(values))
+        samples = np.searchsorted(offsets, rows, side='right') - 1
+        for sample, dim in set(zip(samples, dims)):
+            start, end = offsets[sample], offsets[sample + 1]
+            values[start:end, dim] = interpolate_missing(pd.Series(values[start:end, dim])).values
 
-        return df, labels_df
+        return values.astype(np.float32), offsets, labels
 
     def instance_norm(self, case):
         if self.root_path.count('EthanolConcentration') > 0:  # special process for numerical stability
@@ -509,25 +557,32 @@ class UEAloader(Dataset):
         else:
             return case
 
+    @property
+    def fixed_length(self):
+        # items can be collated once when they are all the same length and not augmented
+        return bool(np.all(np.diff(self.offsets) == self.max_seq_len)) and not (
+            self.flag == "TRAIN" and self.args.augmentation_ratio > 0
+        )
+
     def __getitem__(self, ind):
-        batch_x = self.feature_df.loc[self.all_IDs[ind]].values
-        labels = self.labels_df.loc[self.all_IDs[ind]].values
+        batch_x = self.values[self.offsets[ind]:self.offsets[ind + 1]]
+        labels = self.labels[ind]
         if self.flag == "TRAIN" and self.args.augmentation_ratio > 0:
-            num_samples = len(self.all_IDs)
-            num_columns = self.feature_df.shape[1]
-            seq_len = int(self.feature_df.shape[0] / num_samples)
-            batch_x = batch_x.reshape((1, seq_len, num_columns))
-            batch_x, labels, augmentation_tags = run_augmentation_single(batch_x, labels, self.args)
-
-            batch_x = batch_x.reshape((1 * seq_len, num_columns))
+            batch_x, labels, augmentation_tags = run_augmentation_single(
+                batch_x[np.newaxis], labels, self.args
+            )
+            batch_x = batch_x[0]
 
         return self.instance_norm(torch.from_numpy(batch_x)), \
                torch.from_numpy(labels)
 
     def __len__(self):
-        return len(self.all_IDs)
+        return len(self.labels)
     
 class MimicIII(Dataset):
+    # all samples are seq_len long, so batches can be collated once
+    fixed_length = True
+    
     def __init__(
         self, root_path='./dataset/mimic_iii', flag='train', 
         data_path='patient_vital_preprocessed.pkl', 
@@ -2,6 +2,9 @@ import os
 import numpy as np
 import pandas as pd
 import torch
+import torch.nn.functional as F
+from torch.nn.utils.rnn import pad_sequence
+from torch.utils.data import Dataset
 
 
 def collate_fn(data, max_len=None):
@@ -21,24 +24,21 @@ def collate_fn(data, max_len=None):
         padding_masks: (batch_size, padded_length) boolean tensor, 1 means keep vector at this position, 0 means padding
     """
 
-    batch_size = len(data)
     features, labels = zip(*data)
 
     # Stack and pad features and masks (convert 2D to 3D tensors, i.e. add batch dimension)
-    lengths = [X.shape[0] for X in features]  # original sequence length for each time series
+    lengths = torch.tensor([X.shape[0] for X in features])  # original sequence length for each time series
     if max_len is None:
-        max_len = max(lengths)
+        max_len = int(lengths.max())
 
-    X = torch.zeros(batch_size, max_len, features[0].shape[-1])  # (batch_size, padded_length, feat_dim)
-    for i in range(batch_size):
-        end = min(lengths[i], max_len)
-        X[i, :end, :] = features[i][:end, :]
-        # X[i, :end, :] = features[i][-end:, :] # take recent times
+    # (batch_size, padded_length, feat_dim), longer sequences are clipped
+    X = pad_sequence([X[:max_len] for X in features], batch_first=True).float()
+    if X.shape[1] < max_len:
+        X = F.pad(X, (0, 0, 0, max_len - X.shape[1]))
 
     targets = torch.stack(labels, dim=0)  # (batch_size, num_labels)
 
-    padding_masks = padding_mask(torch.tensor(lengths, dtype=torch.int16),
-                                 max_len=max_len)  # (batch_size, padded_length) boolean tensor, "1" means keep
+    padding_masks = padding_mask(lengths, max_len=max_len)  # (batch_size, padded_length) boolean tensor, "1" means keep
 
     return X, targets, padding_masks
 
@@ -48,12 +48,42 @@ def padding_mask(lengths, max_len=None):
     Used to mask padded positions: creates a (batch_size, max_len) boolean mask from a tensor of sequence lengths,
     where 1 means keep element at this position (time step)
     """
-    batch_size = lengths.numel()
-    max_len = max_len or lengths.max_val()  # trick works because of overloading of 'or' operator for non-boolean types
-    return (torch.arange(0, max_len, device=lengths.device)
-            .type_as(lengths)
-            .repeat(batch_size, 1)
-            .lt(lengths.unsqueeze(1)))
+    max_len = max_len or int(lengths.max())
+    return torch.arange(max_len, device=lengths.device) < lengths.unsqueeze(1)
+
+
+class PrecollatedDataset(Dataset):
+    """
+    Samples of a dataset whose items never change (e.g. fixed length, no augmentation),
+    collated once into stacked tensors. Indexing with a list of indices returns the
+    whole batch, so the DataLoader can use a batch sampler with batch_size=None and
+    skip collating each batch item by item.
+
+    Args:
+        dataset: dataset returning (X, y) samples, see collate_fn.
+        max_len: global fixed sequence length, see collate_fn.
+    """
+
+    def __init__(self, dataset, max_len=None):
+        self.X, self.targets, padding_masks = collate_fn(
+            [dataset[i] for i in range(len(dataset))], max_len=max_len
+        )
+        # a single row is kept when there is no padding, expanded for each batch
+        self.all_valid = bool(padding_masks.all())
+        self.padding_masks = padding_masks[:1] if self.all_valid else padding_masks
+
+    def __getitem__(self, indices):
+        if isinstance(indices, int):
+            return self.X[indices], self.targets[indices]
+
+        if self.all_valid:
+            padding_masks = self.padding_masks.expand(len(indices), -1)
+        else:
+            padding_masks = self.padding_masks[indices]
+        return self.X[indices], self.targets[indices], padding_masks
+
+    def __len__(self):
+        return len(self.X)
 
 
 class Normalizer(object):
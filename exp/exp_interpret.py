@@ -1,5 +1,7 @@
 import os, torch, copy, gc
 from tqdm import tqdm 
+from concurrent.futures import ProcessPoolExecutor
+from torch.utils.data import DataLoader
 import pandas as pd
 import csv
 from utils.explainer import *
@@ -9,6 +11,11 @@ from attrs.winIT import WinIT
 from attrs.gate_mask import GateMask
 from tint.metrics import mae, mse, accuracy, cross_entropy, lipschitz_max, log_odds
 from utils.auc import auc
+from utils.evaluation import evaluate_batched, supports_batched_metrics
+from utils.tools import is_horizon_shared
+from utils.forward_cache import ForwardCache
+from utils.attr_store import AttrStore
+from utils.results_log import ResultsLog
 from datetime import datetime
 from captum.attr import (
     DeepLift,
@@ -26,6 +33,7 @@ from tint.attr import (
     FeatureAblation
 )
 from exp.exp_basic import stringify_setting
+from data.data_factory import DeviceTensorLoader, interpret_loader
 
 expl_metric_map = {
     'mae': mae, 'mse': mse, 'accuracy': accuracy, 
@@ -52,6 +60,88 @@ explainer_name_map = {
     # "ozyegen":FeatureAblation
 }
 
+# explainers that only run perturbed forward passes, so can share the forward cache
+cached_explainers = [
+    'occlusion', 'wtsr', 'feature_ablation', 
+    'augmented_occlusion', 'feature_permutation'
+]
+
+# visible devices of the launching environment, before Exp_Basic._acquire_device narrows
+# them to args.gpu. The shard devices are ordinals among these
+launch_visible_devices = os.environ.get('CUDA_VISIBLE_DEVICES')
+
+def shard_ranges(n_batches, n_shards, start=0):
+    # contiguous batch index ranges, so each shard keeps the batch order for resume
+    bounds = np.linspace(start, n_batches, min(n_shards, n_batches - start) + 1).astype(int)
+    return [(start, end) for start, end in zip(bounds[:-1], bounds[1:])]
+
+def set_visible_devices(visible_devices):
+    # None unsets CUDA_VISIBLE_DEVICES, so all devices are visible
+    if visible_devices is None: os.environ.pop('CUDA_VISIBLE_DEVICES', None)
+    else: os.environ['CUDA_VISIBLE_DEVICES'] = visible_devices
+
+def shard_dataloader(dataloader, start, end):
+    # only loads the batches of this shard, same batches as the full dataloader
+    if isinstance(dataloader, DeviceTensorLoader):
+        return dataloader.shard(start, end)
+    
+    if dataloader.batch_size is None:
+        # the dataset is indexed by whole batches, see PrecollatedDataset
+        return DataLoader(
+            dataloader.dataset, sampler=list(dataloader.sampler)[start:end],
+            batch_size=None, num_workers=dataloader.num_workers
+        )
+    
+    batches = list(dataloader.batch_sampler)[start:end]
+    return DataLoader(
+        dataloader.dataset, batch_sampler=batches,
+        num_workers=dataloader.num_workers,
+        collate_fn=dataloader.collate_fn
+    )
+
+def interpret_shard(shard_id, Exp, args, name, start, end):
+    from run import set_random_seed
+    
+    args = copy.deepcopy(args)
+    
+    device = args.shard_devices[shard_id % len(args.shard_devices)]
+    if device.startswith('cuda'):
+        args.use_gpu, args.use_multi_gpu = True, False
+        ordinal = int(device.split(':')[1]) if ':' in device else 0
+        # only the shard's device is visible to the worker, the parent restored the 
+        # launching CUDA_VISIBLE_DEVICES before spawning it
+        if launch_visible_devices is not None:
+            os.environ['CUDA_VISIBLE_DEVICES'] = launch_visible_devices.split(',')[ordinal].strip()
+        else: os.environ['CUDA_VISIBLE_DEVICES'] = str(ordinal)
+        args.gpu = 0
+        # initializes cuda before the device acquisition changes CUDA_VISIBLE_DEVICES
+        torch.cuda.set_device(args.gpu)
+    else:
+        args.use_gpu = False
+        # split the cpu cores among the shards
+        torch.set_num_threads(max(1, os.cpu_count() // args.n_shards))
+    args.n_shards, args.explainers = 1, [name]
+    
+    # same seed for all shards while the experiment is set up,
+    # the interpretation loader is sequential so the batches are the same in every shard
+    set_random_seed(args.seed)
+    exp = Exp(args)
+    _, dataloader = exp._get_data(args.flag)
+    dataloader = interpret_loader(dataloader, args, exp.device)
+    exp.load_best_model()
+    shard_loader = shard_dataloader(dataloader, start, end)
+    
+    # deterministic seed per shard
+    set_random_seed(args.seed + shard_id)
+    interpreter = Exp_Interpret(exp, dataloader)
+    interpreter.shard_id, interpreter.batch_offset = shard_id, start
+    if args.dump_attrs and not args.dry_run:
+        # the parent has already created the store, shards write to their own rows
+        interpreter.attr_store = interpreter.open_attr_store(dataloader, name, overwrite=False)
+        
+    results, run_fraction = interpreter.run(shard_loader, name)
+    return results, run_fraction * (end - start)
+
 class Exp_Interpret:
     def __init__(
         self, exp, dataloader
@@ -66,10 +156,36 @@ class Exp_Interpret:
         # exp.model.zero_grad()
         self.model = exp.model
         
+        self.forward_cache = ForwardCache(exp.model, max_mb=self.args.forward_cache_mb)
+        # baselines are reused across explainers when caching, otherwise the 
+        # perturbed inputs of different explainers never match
+        self.baselines_map = dict()
+        self.baseline_bank = None
+        add_x_mark = self.args.task_name != 'classification' and self.args.model not in ['CALF', 'OFA']
+        if self.args.baseline_mode == 'gen':
+            # trained once per split and seed, then saved next to the model checkpoint.
+            # in sharded mode the parent trains it, so the shards only load it
+            self.baseline_bank = BaselineGenerator(
+                get_total_data(dataloader, self.device, add_x_mark=add_x_mark),
+                path=os.path.join(self.result_folder, f'baseline_generator_{self.args.flag}.pth'),
+                batch_size=self.args.batch_size
+            )
+        elif self.args.baseline_bank and self.args.baseline_mode in ['aug', 'normal'] and self.args.n_shards <= 1:
+            self.baseline_bank = BaselineBank(
+                get_total_data(dataloader, self.device, add_x_mark=add_x_mark)
+            )
+        
+        # set by the shard workers, batch indices start from the batch_offset
+        self.shard_id, self.batch_offset = None, 0
+        # attributions are streamed here when dump_attrs is set
+        self.attr_store = None
+        
         self.explainers_map = dict() 
-        for name in exp.args.explainers:
+        # the explainers are initialized by the shard workers in sharded mode
+        for name in exp.args.explainers if self.args.n_shards <= 1 else []:
+            model = self.forward_cache if name in cached_explainers else exp.model
             explainer = Exp_Interpret.initialize_explainer(
-                name, exp.model, exp.args, exp.device, dataloader
+                name, model, exp.args, exp.device, dataloader
             ) 
             self.explainers_map[name] = explainer
     
@@ -118,120 +234,30 @@ class Exp_Interpret:
             )
         else:
             explainer = explainer_name_map[name](model) 
+            
+        if name in ['dyna_mask', 'extremal_mask', 'gatemask'] and args.amortize_masks:
+            explainer = MaskTrainer(name, explainer, args)
         
         return explainer    
     
-    def run_classifier(self, dataloader, name):
-        results = [['batch_index', 'metric', 'tau', 'area', 'comp', 'suff']]
-        
-        # this assumes the data is from same flag (train, val, test)
-        batch_filename = os.path.join(self.result_folder, f'batch_{name}.csv')
-        
-        # no writing or resume needed for dry run
-        if not self.args.dry_run:
-            if os.path.exists(batch_filename) and (not self.args.overwrite): 
-                results_df = pd.read_csv(batch_filename)
-                # https://stackoverflow.com/questions/3348460/csv-file-written-with-python-has-blank-lines-between-each-row
-                result_file = open(batch_filename, 'a', newline='')
-                writer = csv.writer(result_file) 
-                
-                rows = results_df.values.tolist()
-                results.extend(rows)
-                if results_df.shape[0]>0: 
-                    min_batch_index = results_df['batch_index'].max() + 1
-                else:
-                    min_batch_index = 0
-            else:
-                min_batch_index = 0
-                # create and write header row if the file doesn't exists or it is to be overwritten
-                result_file = open(batch_filename, 'w', newline='')
-                writer = csv.writer(result_file) 
-                writer.writerow(results[0])
-        else:
-            min_batch_index = 0
-            
-        attrs = []
-        if min_batch_index>0:
-            print(f'Resuming from batch {min_batch_index}')
-        
-        progress_bar = tqdm(
-            enumerate(dataloader), total=len(dataloader), 
-            disable=self.args.disable_progress
-        )
-        
+    def classifier_batches(self, progress_bar):
         for batch_index, (batch_x, _, padding_mask) in progress_bar:
-            if batch_index < min_batch_index:
-                continue
-            
             batch_x = batch_x.float().to(self.device)
             padding_mask = padding_mask.float().to(self.device)
              
             inputs = batch_x
             # baseline must be a scaler or tuple of tensors with same dimension as input
-            baselines = get_baseline(inputs, mode=self.args.baseline_mode)
+            baselines = self.get_batch_baseline(inputs, batch_index)
             
             if self.args.model in ['CALF', 'OFA']:
                 additional_forward_args = None
             else:
                 additional_forward_args = (padding_mask, None, None)
-
-            # get attributions
-            batch_results, batch_attr = self.evaluate(
-                name, inputs, baselines, 
-                additional_forward_args, batch_index
-            )
-            
-            results.extend(batch_results)  
-            attrs.append(batch_attr)
-            gc.collect()
-            
-            if self.args.dry_run: break
-            writer.writerows(batch_results)
-            result_file.flush()
             
-        attrs = torch.vstack(attrs)
-        
-        run_fraction = 1.0 * (batch_index + 1 - min_batch_index) / len(dataloader)
-        return results, attrs, run_fraction
+            yield batch_index, inputs, baselines, additional_forward_args
                 
-    def run_regressor(self, dataloader, name):
-        results = [['batch_index', 'metric', 'tau', 'area', 'comp', 'suff']]
-        
-        # this assumes the data is from same flag (train, val, test)
-        batch_filename = os.path.join(self.result_folder, f'batch_{name}.csv')
-        
-        min_batch_index = 0
-        # no writing or resume needed for dry run
-        if not self.args.dry_run:
-            if os.path.exists(batch_filename) and not self.args.overwrite: 
-                results_df = pd.read_csv(batch_filename)
-                # https://stackoverflow.com/questions/3348460/csv-file-written-with-python-has-blank-lines-between-each-row
-                result_file = open(batch_filename, 'a', newline='')
-                writer = csv.writer(result_file) 
-                
-                rows = results_df.values.tolist()
-                results.extend(rows)
-                if results_df.shape[0]>0: 
-                    min_batch_index = results_df['batch_index'].max() + 1
-            else:
-                # create and write header row if the file doesn't exists or it is to be overwritten
-                result_file = open(batch_filename, 'w', newline='')
-                writer = csv.writer(result_file) 
-                writer.writerow(results[0])
-        
-        attrs = []
-        if min_batch_index > 0:
-            print(f'Resuming from batch {min_batch_index}')
-            
-        progress_bar = tqdm(
-            enumerate(dataloader), total=len(dataloader), 
-            disable=self.args.disable_progress
-        )
-            
+    def regressor_batches(self, progress_bar):
         for batch_index, (batch_x, batch_y, batch_x_mark, batch_y_mark) in progress_bar:
-            if batch_index < min_batch_index:
-                continue
-            
             batch_x = batch_x.float().to(self.device)
             batch_y = batch_y.float().to(self.device)
 
@@ -250,25 +276,216 @@ class Exp_Interpret:
                 additional_forward_args = (dec_inp, batch_y_mark)
                 
             # baseline must be a scaler or tuple of tensors with same dimension as input
-            baselines = get_baseline(inputs, mode=self.args.baseline_mode)
+            baselines = self.get_batch_baseline(inputs, batch_index)
+            
+            yield batch_index, inputs, baselines, additional_forward_args
+    
+    def batch_generator(self, batch_index):
+        # seeded per batch, so serial, sharded and resumed runs draw the same baselines for a batch
+        return torch.Generator(device=self.device).manual_seed(
+            hash((self.args.seed, batch_index))
+        )
+    
+    def get_batch_baseline(self, inputs, batch_index):
+        # zero baselines are the same every time, so don't need to be kept
+        if self.forward_cache.max_bytes <= 0 or self.args.baseline_mode == 'zero':
+            return get_baseline(
+                inputs, mode=self.args.baseline_mode, 
+                generator=self.batch_generator(batch_index), bank=self.baseline_bank
+            )
+        
+        # kept on the host, so the baselines of the whole split don't fill the device
+        if batch_index not in self.baselines_map:
+            baselines = get_baseline(
+                inputs, mode=self.args.baseline_mode, 
+                generator=self.batch_generator(batch_index), bank=self.baseline_bank
+            )
+            if type(baselines) == tuple:
+                self.baselines_map[batch_index] = tuple([b.cpu() for b in baselines])
+            else: self.baselines_map[batch_index] = baselines.cpu()
+            return baselines
+        
+        baselines = self.baselines_map[batch_index]
+        if type(baselines) == tuple:
+            return tuple([b.to(self.device) for b in baselines])
+        return baselines.to(self.device)
+    
+    def batch_filename(self, name, shard_id=None, extension='bin'):
+        # this assumes the data is from same flag (train, val, test)
+        if shard_id is None: shard_id = self.shard_id
+        
+        if shard_id is None:
+            return os.path.join(self.result_folder, f'batch_{name}.{extension}')
+        return os.path.join(self.result_folder, f'batch_{name}_shard_{shard_id}.{extension}')
+    
+    def open_results_log(self, name):
+        # no writing or resume needed for dry run
+        if self.args.dry_run: return None, self.batch_offset
+        
+        log_path = self.batch_filename(name)
+        csv_path = self.batch_filename(name, extension='csv')
+        
+        if not self.args.overwrite and not os.path.exists(log_path) and os.path.exists(csv_path):
+            # import the batch results of the earlier csv format once, so they can be resumed
+            results_log = ResultsLog(log_path, overwrite=True)
+            results_df = pd.read_csv(csv_path)
+            for batch_index, batch_df in results_df.groupby('batch_index', sort=True):
+                results_log.append(batch_index, batch_df.values.tolist())
+        else:
+            results_log = ResultsLog(log_path, overwrite=self.args.overwrite)
+        
+        if results_log.last_batch_index is None:
+            min_batch_index = self.batch_offset
+        else:
+            min_batch_index = results_log.last_batch_index + 1
+        return results_log, min_batch_index
+    
+    def progress_bar(self, dataloader, min_batch_index):
+        # the batch order is sequential, so completed batches are the same samples 
+        # as in the earlier run and are skipped without loading them
+        if min_batch_index > self.batch_offset:
+            print(f'Resuming from batch {min_batch_index}')
+            dataloader = shard_dataloader(
+                dataloader, min_batch_index - self.batch_offset, len(dataloader)
+            )
+        
+        return tqdm(
+            enumerate(dataloader, min_batch_index), total=len(dataloader), 
+            disable=self.args.disable_progress
+        )
+    
+    def last_completed_batch(self, name):
+        log_path = self.batch_filename(name)
+        csv_path = self.batch_filename(name, extension='csv')
+        
+        if os.path.exists(log_path):
+            return ResultsLog.last_batch(log_path)
+        elif os.path.exists(csv_path):
+            results_df = pd.read_csv(csv_path)
+            if results_df.shape[0] > 0: return results_df['batch_index'].max()
+        return None
+    
+    def run(self, dataloader, name):
+        # only kept for the dry run, otherwise the results are in the log
+        results = [['batch_index', 'metric', 'tau', 'area', 'comp', 'suff']]
+        results_log, min_batch_index = self.open_results_log(name)
         
+        progress_bar = self.progress_bar(dataloader, min_batch_index)
+        batch_index = min_batch_index - 1
+        
+        if self.args.task_name == 'classification':
+            batches = self.classifier_batches(progress_bar)
+        else:
+            batches = self.regressor_batches(progress_bar)
+            
+        explainer = self.explainers_map[name]
+        if isinstance(explainer, MaskTrainer):
+            # the masks of several batches can be trained together
+            batches = explainer.prefit(batches)
+            
+        for batch_index, inputs, baselines, additional_forward_args in batches:
             # get attributions
             batch_results, batch_attr = self.evaluate(
                 name, inputs, baselines, 
                 additional_forward_args, batch_index
             )
-            results.extend(batch_results)
-            attrs.append(batch_attr)
             gc.collect()
             
-            if self.args.dry_run: break
+            if self.args.dry_run: 
+                results.extend(batch_results)
+                break
             # writing must appear after dry run break
-            writer.writerows(batch_results)
-            result_file.flush()
+            # attributions are saved before the results, so resumed batches always have them
+            if self.attr_store is not None:
+                self.attr_store.write(batch_index, batch_attr)
+            del batch_attr
+            results_log.append(batch_index, batch_results)
         
-        attrs = tuple(torch.vstack([a[i] for a in attrs]) for i in range(2))
-        run_fraction = 1.0* (batch_index + 1 - min_batch_index) / len(dataloader)
-        return results, attrs, run_fraction
+        if results_log is not None: results_log.close()
+        run_fraction = 1.0 * (batch_index + 1 - min_batch_index) / len(dataloader)
+        return results, run_fraction
+    
+    def run_sharded(self, dataloader, name):
+        results = [['batch_index', 'metric', 'tau', 'area', 'comp', 'suff']]
+        # the shards start after the completed batches of the main log, 
+        # which is only discarded with --overwrite
+        results_log, min_batch_index = self.open_results_log(name)
+        if min_batch_index >= len(dataloader):
+            if results_log is not None: results_log.close()
+            return results, 0
+        
+        ranges = shard_ranges(len(dataloader), self.args.n_shards, start=min_batch_index)
+        if self.args.shard_devices is None:
+            self.args.shard_devices = [
+                f'cuda:{self.args.gpu}' if self.args.use_gpu else 'cpu'
+            ]
+        print(f'Running {len(ranges)} shards from batch {min_batch_index} on {self.args.shard_devices}')
+        
+        for shard_id, (start, end) in enumerate(ranges):
+            # a shard log with batches outside the shard range is from another split, can't be resumed
+            shard_log_path = self.batch_filename(name, shard_id=shard_id)
+            shard_batches = ResultsLog.read_index(shard_log_path)[1]
+            if len(shard_batches) > 0 and (
+                shard_batches[0][0] != start or shard_batches[-1][0] >= end
+            ):
+                ResultsLog.remove(shard_log_path)
+        
+        # the spawned workers inherit the environment, where the parent's device 
+        # acquisition left only args.gpu visible
+        parent_visible_devices = os.environ.get('CUDA_VISIBLE_DEVICES')
+        set_visible_devices(launch_visible_devices)
+        try:
+            with ProcessPoolExecutor(
+                max_workers=len(ranges), 
+                mp_context=torch.multiprocessing.get_context('spawn')
+            ) as executor:
+                futures = [
+                    executor.submit(
+                        interpret_shard, shard_id, type(self.exp), 
+                        self.args, name, start, end
+                    ) for shard_id, (start, end) in enumerate(ranges)
+                ]
+                shard_outputs = [future.result() for future in futures]
+        finally:
+            set_visible_devices(parent_visible_devices)
+        
+        # shards cover contiguous batch ranges, so merging in order keeps the serial order
+        for shard_results, _ in shard_outputs:
+            results.extend(shard_results[1:])
+        
+        run_fraction = sum(
+            batches_run for _, batches_run in shard_outputs
+        ) / len(dataloader)
+        
+        # the shard logs are appended to the main log in batch order, then are no longer needed
+        if results_log is not None:
+            for shard_id, (_, end) in enumerate(ranges):
+                shard_log_path = self.batch_filename(name, shard_id=shard_id)
+                shard_log = ResultsLog(shard_log_path)
+                results_log.extend(shard_log, end=end)
+                shard_log.close()
+                ResultsLog.remove(shard_log_path)
+            results_log.close()
+        
+        return results, run_fraction
+    
+    def open_attr_store(self, dataloader, name, overwrite):
+        n_samples = len(dataloader.dataset)
+        sample = dataloader.dataset[0]
+        
+        if self.args.task_name == 'classification':
+            # inputs are padded to seq_len in the collate function
+            shapes = [(n_samples, self.args.num_class, self.args.seq_len, sample[0].shape[-1])]
+        else:
+            shapes = [(n_samples, self.args.pred_len) + tuple(sample[0].shape)]
+            if self.args.model not in ['CALF', 'OFA']:
+                # batch_x_mark
+                shapes.append((n_samples, self.args.pred_len) + tuple(sample[2].shape))
+        
+        return AttrStore(
+            self.result_folder, f'{self.args.flag}_{name}', shapes, 
+            self.args.batch_size, overwrite=overwrite
+        )
     
     def record_time_efficiency(self, start, end, name, run_fraction):
         if self.args.dry_run or (not self.args.overwrite and run_fraction == 0): return
@@ -304,32 +521,39 @@ class Exp_Interpret:
         time_efficiency_file.close()
     
     def interpret(self, dataloader):
-        task = self.args.task_name
-        
         for name in self.args.explainers:
             explainer_result_file = os.path.join(self.result_folder, f'{name}.csv')
-            explainer_batch_file = os.path.join(self.result_folder, f'batch_{name}.csv')
-            if (not self.args.overwrite) and os.path.exists(explainer_result_file) and os.path.exists(explainer_batch_file):
-                df = pd.read_csv(explainer_batch_file)
-                if df.shape[0] > 0 and df['batch_index'].max() + 1 == len(dataloader):
+            if (not self.args.overwrite) and os.path.exists(explainer_result_file):
+                last_batch_index = self.last_completed_batch(name)
+                if last_batch_index is not None and last_batch_index + 1 == len(dataloader):
                     print(f'{explainer_result_file} exists. Skipping ...')
                     continue
             
             start = datetime.now()
             print(f'\nRunning {name} from {start}')
+            self.forward_cache.reset_stats()
             
-            if task == 'classification':
-                results, attrs, run_fraction = self.run_classifier(dataloader, name)
+            # don't dump attr if dry run
+            if self.args.dump_attrs and not self.args.dry_run:
+                # existing attributions are kept when resuming
+                self.attr_store = self.open_attr_store(
+                    dataloader, name, overwrite=self.args.overwrite
+                )
+            
+            if self.args.n_shards > 1:
+                results, run_fraction = self.run_sharded(dataloader, name)
             else:
-                results, attrs, run_fraction = self.run_regressor(dataloader, name)
+                results, run_fraction = self.run(dataloader, name)
             
             # this might not reflect the correct time if the results are resumed from a checkpoint
             end = datetime.now()
             print(f'Experiment ended at {end}. Total time taken {end - start}.')
             self.record_time_efficiency(start, end, name, run_fraction)
+            if self.forward_cache.max_bytes > 0:
+                print(self.forward_cache.stats())
             
             if not self.args.dry_run:
-                self.dump_results(results, f'{name}.csv')
+                self.dump_results(name)
             else:
                 results_df = pd.DataFrame(results[1:], columns=results[0])
                 results_df = results_df.groupby(['metric', 'area'])[
@@ -338,17 +562,7 @@ class Exp_Interpret:
                 print('Dry run results')
                 print(results_df)
                 
-            # don't dump attr if dry run
-            if self.args.dump_attrs and not self.args.dry_run:
-                attr_output_file = f'{self.args.flag}_{name}.pt' 
-                attr_output_path = os.path.join(self.result_folder, attr_output_file)
-                
-                if task == 'classification':
-                    attr_numpy = [a.detach().cpu().numpy() for a in attrs]
-                else:
-                    attr_numpy = tuple([a.detach().cpu().numpy() for a in attrs])
-                    torch.save(attr_numpy, attr_output_path)
-            
+            self.attr_store = None
             gc.collect()
             print()
                 
@@ -366,8 +580,36 @@ class Exp_Interpret:
         results = []
         
         pred_len = self.args.num_class if self.args.task_name == 'classification' else self.args.pred_len
+        
+        if supports_batched_metrics(self.args.metrics):
+            # pred_len x metrics x areas x (comp, suff)
+            scores = evaluate_batched(
+                self.forward_cache, inputs=inputs, attr=attr, baselines=baselines,
+                additional_forward_args=additional_forward_args,
+                metrics=self.args.metrics, areas=self.args.areas,
+                eval_batch_size=self.args.eval_batch_size
+            )
+            for tau in range(pred_len):
+                for metric_index, metric_name in enumerate(self.args.metrics):
+                    for area_index, area in enumerate(self.args.areas):
+                        error_comp, error_suff = scores[tau, metric_index, area_index]
+                        results.append([
+                            batch_index, metric_name, tau, area, 
+                            np.round(error_comp, 6), np.round(error_suff, 6)
+                        ])
+            return results, attr
+        
         # get scores
+        horizon_shared = is_horizon_shared(attr)
         for tau in range(pred_len):
+            if horizon_shared and tau > 0:
+                # same attributions for every horizon, so the same scores as tau 0
+                results.extend([
+                    [batch_index, metric_name, tau, area, error_comp, error_suff]
+                    for _, metric_name, _, area, error_comp, error_suff in results[:n_rows]
+                ])
+                continue
+            
             if type(attr) == tuple:
                 # batch x pred_len x seq_len x features
                 attr_per_pred = tuple([
@@ -379,7 +621,7 @@ class Exp_Interpret:
                 for area in self.args.areas:
                     metric = expl_metric_map[metric_name]
                     error_comp = metric(
-                        self.model, inputs=inputs, 
+                        self.forward_cache, inputs=inputs, 
                         attributions=attr_per_pred, baselines=baselines, 
                         additional_forward_args=additional_forward_args,
                         topk=area, mask_largest=True # this is default
@@ -389,7 +631,7 @@ class Exp_Interpret:
                         # these metrics doesn't have mask_largest parameter
                         error_suff = 0
                     else: error_suff = metric(
-                        self.model, inputs=inputs,
+                        self.forward_cache, inputs=inputs,
                         attributions=attr_per_pred, baselines=baselines, 
                         additional_forward_args=additional_forward_args,
                         topk=area, mask_largest=False
@@ -400,19 +642,19 @@ class Exp_Interpret:
                         np.round(error_comp, 6), np.round(error_suff, 6)
                     ]
                     results.append(result_row)
+            n_rows = len(results)
     
         return results, attr
         
-    def dump_results(self, results, filename):
-        results_df = pd.DataFrame(results[1:], columns=results[0])
-        
-        batch_filename = os.path.join(self.result_folder, f'batch_{filename}')
-        results_df.round(6).to_csv(batch_filename, index=False)
+    def dump_results(self, name):
+        results_log = ResultsLog(self.batch_filename(name))
+        if self.args.batch_csv:
+            results_log.to_csv(self.batch_filename(name, extension='csv'))
         
-        results_df = results_df.groupby(['metric', 'area'])[
-            ['comp', 'suff']
-        ].aggregate('mean').reset_index()
+        # streaming group by (metric, area), the batch results aren't loaded at once
+        results_df = results_log.aggregate()
+        results_log.close()
         
-        filepath = os.path.join(self.result_folder, filename)
+        filepath = os.path.join(self.result_folder, f'{name}.csv')
         results_df.round(6).to_csv(filepath, index=False)
         print(results_df)
\ No newline at end of file
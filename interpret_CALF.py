@@ -6,6 +6,7 @@ from exp.exp_long_term_forecasting import *
 from exp.exp_classification import Exp_Classification
 from utils.explainer import *
 from exp.exp_interpret import Exp_Interpret, explainer_name_map
+from data.data_factory import interpret_loader
 
 # Following disables pl logging for GPU
 # https://github.com/Lightning-AI/pytorch-lightning/issues/3431
@@ -38,6 +39,8 @@ def main(args):
         
         exp = Exp(args)  # set experiments
         _, dataloader = exp._get_data(args.flag)
+        # sequential, optionally materialized once, and reused by all explainers
+        dataloader = interpret_loader(dataloader, args, exp.device)
 
         exp.load_best_model()
 
@@ -63,10 +66,34 @@ def get_parser():
     parser.add_argument('--baseline_mode', type=str, default='random',
         choices=['random', 'aug', 'zero', 'mean', 'normal', 'gen'],
         help='how to create the baselines for the interepretation methods')
+    parser.add_argument('--baseline_bank', action='store_true', 
+        help='sample the aug and normal baselines from the feature distribution of the whole split, instead of the batch')
     parser.add_argument('--metrics', nargs='*', type=str, default=['mae', 'mse'], 
         help='interpretation evaluation metrics')
+    parser.add_argument('--eval_batch_size', type=int, default=1024, 
+        help='max number of perturbed samples stacked in a single forward pass during evaluation')
+    parser.add_argument('--vectorize_targets', action='store_true', 
+        help='compute gradient attributions for all output targets from one integration pass')
+    parser.add_argument('--perturbation_batch_size', type=int, default=128, 
+        help='max number of perturbed samples stacked together by TSR and WinIT')
+    parser.add_argument('--amortize_masks', action='store_true', 
+        help='keep one trainer and mask network for dyna_mask, extremal_mask and gatemask across batches, warm starting each batch from the previous one')
+    parser.add_argument('--mask_train_batches', type=int, default=1, 
+        help='with --amortize_masks, number of batches whose masks are trained together as one dataset')
+    parser.add_argument('--compile_masks', action='store_true', 
+        help='compile the masked forward of dyna_mask, extremal_mask and gatemask with torch.compile. Compiled once with --amortize_masks, otherwise for every batch')
+    parser.add_argument('--tensor_loader', type=str, default='none', choices=['none', 'pinned', 'device'],
+        help='materialize the split once as float32 tensors, pinned in host memory or on the device, and serve batches as slices')
+    parser.add_argument('--forward_cache_mb', type=float, default=0, 
+        help='size in MB of the model output cache shared by the perturbation based explainers and evaluation. 0 disables it. Hashing the inputs can cost more than the forward of small models on cpu')
+    parser.add_argument('--n_shards', type=int, default=1, 
+        help='number of worker processes the batches are split across during interpretation')
+    parser.add_argument('--shard_devices', nargs='+', type=str, default=None, 
+        help='devices assigned to the shards round robin, e.g. cpu or cuda:0 cuda:1. Defaults to the experiment device')
     parser.add_argument('--overwrite', action='store_true', help='overwrite previous results')
-    parser.add_argument('--dump_attrs', action='store_true', help='dump raw attributes in torch file')
+    parser.add_argument('--batch_csv', action='store_true', 
+        help='also export the batch results from the binary log to batch_{name}.csv')
+    parser.add_argument('--dump_attrs', action='store_true', help='dump raw attributes to memory mapped .npy files, one per input')
     
     parser.add_argument('--disable_progress', action='store_true', help='disble progress bar')
     return parser
@@ -0,0 +1,60 @@
+"""
+Benchmarks the vectorized time feature encoding against the previous per row
+pandas apply, and checks both give the same features.
+Run from the project root: python -m scripts.benchmark_time_features
+"""
+import time
+import numpy as np
+import pandas as pd
+from utils.timefeatures import encode_time_features, time_features
+
+def per_row_time_features(dates, timeenc=0, freq='h'):
+    # the previous add_time_features
+    df_stamp = pd.DataFrame()
+    df_stamp['date'] = pd.to_datetime(dates)
+    if timeenc == 0:
+        df_stamp['month'] = df_stamp.date.apply(lambda row: row.month, 1)
+        df_stamp['day'] = df_stamp.date.apply(lambda row: row.day, 1)
+        df_stamp['weekday'] = df_stamp.date.apply(lambda row: row.weekday(), 1)
+        df_stamp['hour'] = df_stamp.date.apply(lambda row: row.hour, 1)
+        data_stamp = df_stamp.drop(columns=['date']).values
+    elif timeenc == 1:
+        data_stamp = time_features(pd.to_datetime(df_stamp['date'].values), freq=freq)
+        data_stamp = data_stamp.transpose(1, 0)
+    return data_stamp
+
+def benchmark(name, function, repeat=3):
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = function()
+        durations.append(time.perf_counter() - start)
+    print(f'{name:<45} {min(durations):.4f}s')
+    return output
+
+if __name__ == '__main__':
+    # electricity like hourly dates
+    dates = pd.date_range('2016-07-01', periods=26304, freq='h').values
+    # overlapping windows, like MultiTimeSeries used to encode one by one
+    windows = [dates[start:start + 120] for start in range(0, 2000)]
+
+    for timeenc in [0, 1]:
+        print(f'\ntimeenc={timeenc}, {len(dates)} dates')
+        expected = benchmark(
+            'per row', lambda: per_row_time_features(dates, timeenc)
+        )
+        # not memoized yet for this timeenc
+        output = benchmark(
+            'vectorized (first call)', lambda: encode_time_features(dates, timeenc), repeat=1
+        )
+        benchmark('vectorized (memoized)', lambda: encode_time_features(dates, timeenc))
+        assert np.allclose(expected, output), 'time features do not match'
+
+        print(f'{len(windows)} overlapping windows of 120 dates')
+        expected = benchmark(
+            'per row', lambda: [per_row_time_features(w, timeenc) for w in windows], repeat=1
+        )
+        output = benchmark(
+            'vectorized', lambda: [encode_time_features(w, timeenc) for w in windows], repeat=1
+        )
+        assert all(np.allclose(e, o) for e, o in zip(expected, output)), 'time features do not match'
@@ -0,0 +1,68 @@
+"""
+Checks the MaskOptimizer gives the same attributions as the Lightning Trainer
+for dyna_mask, extremal_mask and gatemask, and times both.
+Run from the project root: python -m scripts.check_mask_optimizer [--compile]
+"""
+import sys, time, warnings, logging
+import torch
+from pytorch_lightning import Trainer, seed_everything
+from pytorch_lightning.callbacks import EarlyStopping
+from tint.attr import DynaMask, ExtremalMask
+from attrs.gate_mask import GateMask
+from attrs.mask_optimizer import MaskOptimizer
+from utils.explainer import gatemask_net
+
+warnings.filterwarnings('ignore')
+logging.getLogger('lightning.pytorch').setLevel(logging.ERROR)
+logging.getLogger('pytorch_lightning').setLevel(logging.ERROR)
+
+def lightning_trainer(max_epochs, patience=None):
+    return Trainer(
+        logger=False, enable_checkpointing=False,
+        enable_progress_bar=False, max_epochs=max_epochs,
+        enable_model_summary=False, accelerator='cpu',
+        callbacks=[] if patience is None else [
+            EarlyStopping('train_loss', patience=patience, mode='min', verbose=False)
+        ]
+    )
+
+def attribute(name, model, inputs, baselines, trainer):
+    if name == 'dyna_mask':
+        return DynaMask(model).attribute(inputs, trainer=trainer)
+    elif name == 'extremal_mask':
+        return ExtremalMask(model).attribute(inputs, trainer=trainer)
+
+    return GateMask(model).attribute(
+        inputs, baselines=baselines, trainer=trainer, batch_size=16,
+        mask_net=gatemask_net(model, inputs.shape[-1])
+    )
+
+def run(name, model, inputs, baselines, trainer):
+    seed_everything(0, verbose=False)
+    start = time.perf_counter()
+    attr = attribute(name, model, inputs, baselines, trainer)
+    return attr, time.perf_counter() - start
+
+if __name__ == '__main__':
+    compile = '--compile' in sys.argv[1:]
+    seed_everything(0, verbose=False)
+    # batch x seq_len x features -> batch x pred_len
+    model = torch.nn.Sequential(
+        torch.nn.Flatten(), torch.nn.Linear(48 * 5, 32),
+        torch.nn.ReLU(), torch.nn.Linear(32, 8)
+    )
+    inputs = torch.randn(32, 48, 5)
+    baselines = torch.zeros_like(inputs)
+
+    for name, max_epochs, patience in [
+        ('dyna_mask', 100, None), ('extremal_mask', 100, None), ('gatemask', 50, 10)
+    ]:
+        expected, lightning_duration = run(
+            name, model, inputs, baselines, lightning_trainer(max_epochs, patience)
+        )
+        output, duration = run(
+            name, model, inputs, baselines,
+            MaskOptimizer(max_epochs, patience, compile=compile)
+        )
+        assert torch.allclose(expected, output, atol=1e-5), f'{name} attributions do not match'
+        print(f'{name:<15} lightning {lightning_duration:.3f}s, mask optimizer {duration:.3f}s')
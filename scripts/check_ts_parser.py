@@ -0,0 +1,63 @@
+"""
+Checks the bulk .ts parser against load_from_tsfile_to_dataframe and times both.
+Uses synthetic files covering missing values, varying lengths, dimensions of
+different lengths and timestamps (fallback), plus any .ts files given.
+Run from the project root: python -m scripts.check_ts_parser [files.ts ...]
+"""
+import os, sys, time, tempfile
+import numpy as np
+from utils.sktime import (
+    load_from_tsfile_to_dataframe, load_from_tsfile_to_arrays, dataframe_to_arrays
+)
+
+header = '@problemName {name}\n@timeStamps {timestamps}\n@missing true\n@univariate false\n' \
+    '@dimensions {dims}\n@equalLength false\n@classLabel true Up Down Flat\n@data\n'
+
+def write_synthetic(folder, name, n_cases, dim_lengths, timestamps=False, seed=0):
+    # dim_lengths: function of (case, dimension) giving the series length
+    rng = np.random.default_rng(seed)
+    path = os.path.join(folder, f'{name}.ts')
+    with open(path, 'w') as file:
+        file.write(header.format(
+            name=name, timestamps=str(timestamps).lower(), dims=len(dim_lengths(0))
+        ))
+        for case in range(n_cases):
+            dimensions = []
+            for length in dim_lengths(case):
+                values = ['?' if rng.random() < 0.02 else repr(float(value)) for value in rng.normal(size=length)]
+                if timestamps:
+                    values = [f'({t},{value})' for t, value in enumerate(values)]
+                dimensions.append(','.join(values))
+            file.write(':'.join(dimensions) + ':' + ['Up', 'Down', 'Flat'][case % 3] + '\n')
+    return path
+
+def check(path):
+    start = time.perf_counter()
+    data, class_values = load_from_tsfile_to_dataframe(path, return_separate_X_and_y=True)
+    expected = dataframe_to_arrays(data) + (class_values, )
+    dataframe_duration = time.perf_counter() - start
+
+    start = time.perf_counter()
+    output = load_from_tsfile_to_arrays(path)
+    arrays_duration = time.perf_counter() - start
+
+    for name, e, o in zip(['values', 'offsets', 'lengths', 'class values'], expected, output):
+        assert e.shape == o.shape, f'{path}: {name} shape {e.shape} != {o.shape}'
+        if e.dtype.kind == 'f':
+            assert np.array_equal(e, o, equal_nan=True), f'{path}: {name} do not match'
+        else:
+            assert np.array_equal(e, o), f'{path}: {name} do not match'
+
+    print(f'{os.path.basename(path):<25} dataframe {dataframe_duration:.3f}s, arrays {arrays_duration:.3f}s')
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as folder:
+        paths = [
+            write_synthetic(folder, 'equal_length', 2000, lambda case: [150] * 6),
+            write_synthetic(folder, 'varying_length', 500, lambda case: [30 + case % 70] * 3),
+            write_synthetic(folder, 'unequal_dimensions', 300, lambda case: [300, 150, 0]),
+            write_synthetic(folder, 'timestamps', 50, lambda case: [20, 20], timestamps=True)
+        ] + sys.argv[1:]
+
+        for path in paths:
+            check(path)
@@ -0,0 +1,61 @@
+import os
+import numpy as np
+from utils.tools import is_horizon_shared
+
+class AttrStore:
+    """
+    Preallocated on-disk store of the attributions, one .npy memory map per input
+    with the samples of batch b at rows [b * batch_size, (b+1) * batch_size).
+    Each batch is written as soon as it is computed, so the whole attribution
+    volume never sits in memory. The files can be read lazily with
+    np.load(path, mmap_mode='r') or AttrStore.load.
+
+    Args:
+        folder: where the files are saved.
+        prefix: file name prefix, input i is saved in {prefix}_{i}.npy.
+        shapes: shape of the attribution of each input, samples x pred_len x seq_len x features.
+        batch_size: batch size of the dataloader.
+        overwrite: discard the existing files. Otherwise they are reopened,
+            so previously written batches are kept when resuming.
+    """
+    def __init__(self, folder, prefix, shapes, batch_size, overwrite=False):
+        self.batch_size = batch_size
+        self.paths = [
+            os.path.join(folder, f'{prefix}_{i}.npy') for i in range(len(shapes))
+        ]
+        self.arrays = []
+
+        for path, shape in zip(self.paths, shapes):
+            shape = tuple(int(dim) for dim in shape)
+            if not overwrite and os.path.exists(path):
+                array = np.lib.format.open_memmap(path, mode='r+')
+                if array.shape == shape:
+                    self.arrays.append(array)
+                    continue
+                print(f'Shape mismatch for {path}, {array.shape} != {shape}. Recreating it.')
+                del array
+
+            self.arrays.append(np.lib.format.open_memmap(
+                path, mode='w+', dtype=np.float32, shape=shape
+            ))
+
+    def write(self, batch_index, attr):
+        if type(attr) != tuple: attr = (attr, )
+
+        start = batch_index * self.batch_size
+        for array, attr_ in zip(self.arrays, attr):
+            # attributions shared by all horizons are copied to the host once, then broadcast
+            if is_horizon_shared(attr_): attr_ = attr_[:, :1]
+            array[start:start + attr_.shape[0]] = attr_.detach().cpu().numpy()
+            array.flush()
+
+    @staticmethod
+    def load(folder, prefix, mmap_mode='r'):
+        arrays = []
+        while os.path.exists(os.path.join(folder, f'{prefix}_{len(arrays)}.npy')):
+            arrays.append(np.load(
+                os.path.join(folder, f'{prefix}_{len(arrays)}.npy'), mmap_mode=mmap_mode
+            ))
+
+        if len(arrays) == 1: return arrays[0]
+        return tuple(arrays)
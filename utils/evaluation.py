@@ -0,0 +1,192 @@
+import torch
+import numpy as np
+from captum._utils.common import (
+    _expand_additional_forward_args,
+    _format_additional_forward_args,
+    _run_forward
+)
+from tint.metrics.mae import _mae
+from tint.metrics.mse import _mse
+from tint.metrics.accuracy import _accuracy
+from tint.metrics.cross_entropy import _cross_entropy
+from tint.metrics.log_odds import _log_odds
+from utils.auc import _auc
+from utils.tools import is_horizon_shared
+
+# metric name -> (per sample metric function, uses class probabilities)
+batched_metric_map = {
+    'mae': (_mae, False), 'mse': (_mse, False),
+    'accuracy': (_accuracy, True), 'cross_entropy': (_cross_entropy, True),
+    'log_odds': (_log_odds, True), 'auc': (_auc, True)
+}
+
+# these return a single value for the whole batch instead of one per sample
+batch_level_metrics = ['auc']
+
+# these metrics doesn't have mask_largest parameter
+comp_only_metrics = ['comprehensiveness', 'sufficiency', 'log_odds']
+
+def supports_batched_metrics(metrics):
+    return all(metric_name in batched_metric_map for metric_name in metrics)
+
+def topk_rank(attr):
+    """
+    Rank of each attribution within its sample, 0 being the largest.
+    attr: (..., n_elements) -> (..., n_elements) long tensor
+    """
+    order = torch.argsort(attr, dim=-1, descending=True, stable=True)
+    positions = torch.arange(
+        attr.shape[-1], device=attr.device
+    ).expand_as(order)
+    return torch.empty_like(order).scatter_(-1, order, positions)
+
+def topk_bounds(n_elements, areas, modes):
+    """
+    The rank range [low, high) masked for each (area, mode) combination. This
+    follows tint's _base_metric, mask_largest=True masks the int(n * area) largest
+    attributions and mask_largest=False masks the int(n * (1-area)) smallest.
+
+    Returns: two (len(areas) * len(modes)) long tensors, low and high
+    """
+    bounds = []
+    for area in areas:
+        for mask_largest in modes:
+            if mask_largest:
+                bounds.append((0, int(n_elements * area)))
+            else:
+                bounds.append((n_elements - int(n_elements * (1.0 - area)), n_elements))
+
+    return torch.tensor(bounds).T
+
+def evaluate_batched(
+    forward_func, inputs, attr, baselines,
+    additional_forward_args, metrics, areas,
+    eval_batch_size=1024
+):
+    """
+    Computes the comprehensiveness (mask_largest=True) and sufficiency
+    (mask_largest=False) scores of every metric for all output horizons and areas.
+    Instead of calling the tint metric for each (tau, metric, area, mode),
+    the model is run once on the original input and once per distinct
+    perturbed input, with perturbed variants stacked along the batch dimension
+    in chunks of at most eval_batch_size samples (or one batch, if larger).
+    The masks and perturbed inputs are only built for the chunk being forwarded.
+
+    attr: batch x pred_len x seq_len x features or a tuple of them. Attributions
+        shared by all horizons (see is_horizon_shared) are scored once.
+    Returns: pred_len x len(metrics) x len(areas) x 2 (comp, suff) numpy array
+    """
+    if is_horizon_shared(attr):
+        n_tau = attr[0].shape[1] if type(attr) == tuple else attr.shape[1]
+        attr = tuple(a[:, :1] for a in attr) if type(attr) == tuple else attr[:, :1]
+        return evaluate_batched(
+            forward_func, inputs, attr, baselines, additional_forward_args,
+            metrics, areas, eval_batch_size
+        ).repeat(n_tau, axis=0)
+    
+    input_is_tuple = type(inputs) == tuple
+    if not input_is_tuple:
+        inputs, attr, baselines = (inputs, ), (attr, ), (baselines, )
+    elif type(baselines) != tuple:
+        baselines = tuple(baselines for _ in inputs)
+
+    additional_forward_args = _format_additional_forward_args(additional_forward_args)
+
+    batch_size, n_tau = inputs[0].shape[0], attr[0].shape[1]
+    need_suff = any(metric_name not in comp_only_metrics for metric_name in metrics)
+    modes = [True, False] if need_suff else [True]
+    n_combos = len(areas) * len(modes)
+    # rank range masked by each (area, mode), for each input
+    bounds = [topk_bounds(attr_[0, 0].numel(), areas, modes) for attr_ in attr]
+
+    # the number of output horizons evaluated together in each chunk
+    taus_per_chunk = max(1, eval_batch_size // (batch_size * n_combos))
+    variants_per_forward = max(1, eval_batch_size // batch_size)
+
+    scores = np.zeros((n_tau, len(metrics), len(areas), 2))
+
+    with torch.no_grad():
+        logits_original = _run_forward(
+            forward_func, inputs, additional_forward_args=additional_forward_args
+        )
+        prob_original = logits_original.softmax(-1)
+        # target is the original prediction, same as tint metrics for classification
+        target = logits_original.argmax(-1)
+
+        for tau_start in range(0, n_tau, taus_per_chunk):
+            tau_end = min(tau_start + taus_per_chunk, n_tau)
+            n_variants = (tau_end - tau_start) * n_combos
+
+            # n_tau x batch x (seq_len x features)
+            ranks = [
+                topk_rank(attr_[:, tau_start:tau_end].transpose(0, 1).reshape(
+                    (tau_end - tau_start, batch_size, -1)
+                ).to(input.device)) for input, attr_ in zip(inputs, attr)
+            ]
+
+            logits_pert = []
+            # the variants are ordered (tau, area, mode), like the scores
+            for start in range(0, n_variants, variants_per_forward):
+                variants = torch.arange(start, min(start + variants_per_forward, n_variants))
+
+                inputs_pert = []
+                for input, rank, (low, high), baseline in zip(inputs, ranks, bounds, baselines):
+                    rank = rank[(variants // n_combos).to(rank.device)]
+                    low, high = [
+                        bound[variants % n_combos].to(rank.device).reshape((-1, 1, 1))
+                        for bound in (low, high)
+                    ]
+                    mask = (rank >= low) & (rank < high)
+                    mask = mask.reshape((len(variants), ) + input.shape)
+                    if baseline is None: baseline = 0
+                    if not isinstance(baseline, torch.Tensor):
+                        baseline = torch.full_like(input, baseline)
+
+                    # (variants x batch) x seq_len x features
+                    inputs_pert.append(
+                        torch.where(mask, baseline.unsqueeze(0), input.unsqueeze(0)).reshape(
+                            (-1, ) + input.shape[1:]
+                        )
+                    )
+                    del mask
+
+                logits_pert.append(_run_forward(
+                    forward_func, tuple(inputs_pert),
+                    additional_forward_args=_expand_additional_forward_args(
+                        additional_forward_args, len(variants)
+                    )
+                ))
+                del inputs_pert
+            logits_pert = torch.cat(logits_pert, dim=0)
+            del ranks
+
+            for metric_index, metric_name in enumerate(metrics):
+                metric, use_prob = batched_metric_map[metric_name]
+                if use_prob:
+                    original, perturbed = prob_original, logits_pert.softmax(-1)
+                else:
+                    original, perturbed = logits_original, logits_pert
+
+                if metric_name in batch_level_metrics:
+                    values = torch.stack([
+                        metric(
+                            original, perturbed[v*batch_size:(v+1)*batch_size], target
+                        ).mean() for v in range(n_variants)
+                    ])
+                else:
+                    values = metric(
+                        _expand_additional_forward_args((original,), n_variants)[0],
+                        perturbed, target.repeat(n_variants) if use_prob else None
+                    ).reshape((n_variants, -1)).mean(dim=-1)
+
+                values = values.reshape(
+                    (tau_end - tau_start, len(areas), len(modes))
+                ).cpu().numpy()
+                scores[tau_start:tau_end, metric_index, :, :len(modes)] = values
+
+                if metric_name in comp_only_metrics:
+                    scores[tau_start:tau_end, metric_index, :, 1] = 0
+
+            del logits_pert
+
+    return scores
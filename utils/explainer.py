@@ -1,16 +1,33 @@
-import torch
+import torch, os
 import numpy as np
+from itertools import islice
 from utils.tools import reshape_over_output_horizon, round_up
 from pytorch_lightning import Trainer
 from exp.exp_basic import dual_input_users
+from data.data_factory import DeviceTensorLoader
 from attrs.gatemasknn import GateMaskNet
+from attrs.mask_optimizer import MaskOptimizer
 from tint.models import MLP, RNN
 from pytorch_lightning.callbacks import EarlyStopping
-from tint.attr.models import JointFeatureGeneratorNet
+from tint.attr import DynaMask
+from tint.attr.models import JointFeatureGeneratorNet, MaskNet, ExtremalMaskNet
+from tint.utils import TensorDataset as MaskDataset, default_collate
 from pytorch_lightning import Trainer
 from torch.utils.data import DataLoader, TensorDataset
+from captum._utils.common import (
+    _expand_additional_forward_args,
+    _format_additional_forward_args,
+    _format_baseline
+)
+from captum.attr._utils.approximation_methods import approximation_parameters
 
-def get_total_data(dataloader, device, add_x_mark=True):        
+def get_total_data(dataloader, device, add_x_mark=True):
+    if isinstance(dataloader, DeviceTensorLoader):
+        # already materialized by a DeviceTensorLoader
+        tensors = dataloader.tensors
+        if add_x_mark: return (tensors[0].to(device), tensors[2].to(device))
+        return tensors[0].to(device)
+    
     if add_x_mark:
         return (
             torch.vstack([item[0] for item in dataloader]).float().to(device), 
@@ -19,84 +36,370 @@ def get_total_data(dataloader, device, add_x_mark=True):
     else:
         return torch.vstack([item[0] for item in dataloader]).float().to(device)
 
-def get_baseline(inputs, mode='random'):
+class BaselineBank:
+    """
+    Per feature value distribution of a whole split, computed once so the
+    aug and normal baselines of each batch can be sampled from it directly.
+    
+    Args:
+        data: samples x seq_len x features tensor, or a tuple of them for multiple inputs.
+    """
+    def __init__(self, data):
+        if type(data) == tuple:
+            self.banks = tuple([BaselineBank(input) for input in data])
+            return
+        
+        self.values = data.reshape((-1, data.shape[-1]))
+        self.means = self.values.mean(dim=0)
+        self.std = self.values.std(dim=0)
+        
+    def __getitem__(self, index):
+        return self.banks[index]
+
+class BaselineGenerator:
+    """
+    JointFeatureGeneratorNet trained once on a whole split, to sample the gen
+    baselines of every batch. The trained generator is saved to path and
+    loaded from there in later runs.
+    
+    Args:
+        data: samples x seq_len x features tensor, or a tuple of them for multiple inputs.
+        path: checkpoint path, input i is saved with suffix _i for multiple inputs.
+            The generator isn't saved if None.
+        batch_size: training batch size.
+        max_epochs: max training epochs.
+    """
+    def __init__(self, data, path=None, batch_size=32, max_epochs=100):
+        if type(data) == tuple:
+            self.banks = tuple([
+                BaselineGenerator(
+                    input, None if path is None else 
+                    f'_{input_index}'.join(os.path.splitext(path)),
+                    batch_size, max_epochs
+                ) for input_index, input in enumerate(data)
+            ])
+            return
+        
+        self.generator = JointFeatureGeneratorNet()
+        self.generator.net.init(feature_size=data.shape[-1])
+        self.generator.to(data.device)
+        
+        if path is not None and os.path.exists(path):
+            print(f'Loading baseline generator from {path}')
+            self.generator.net.load_state_dict(torch.load(path))
+        else:
+            trainer = Trainer(
+                logger=False, enable_checkpointing=False,
+                enable_progress_bar=False, max_epochs=max_epochs,
+                enable_model_summary=False,accelerator='auto',
+                callbacks=[EarlyStopping('train_loss', patience=5, mode='min', verbose=False)],
+                # precision='64'
+            )
+            # a last batch of one sample breaks the batch norm layers
+            dataloader = DataLoader(
+                TensorDataset(data), batch_size=batch_size, shuffle=True,
+                drop_last=len(data) > batch_size
+            )
+            trainer.fit(self.generator, train_dataloaders=dataloader)
+            self.generator.to(data.device)
+            
+            if path is not None:
+                print(f'Saving baseline generator to {path}')
+                torch.save(self.generator.net.state_dict(), path)
+                
+        self.generator.eval()
+        
+    def __getitem__(self, index):
+        return self.banks[index]
+    
+    def sample(self, inputs, generator=None):
+        """
+        Samples x_t from P(x_t | x_0:t-1) for every t > 0 at once. The GRU output
+        at t-1 is the same encoding of the prefix x_0:t-1 the generator uses for
+        one step, so all prefixes are encoded in a single pass over the inputs.
+        """
+        net = self.generator.net
+        batch_size, seq_len, n_features = inputs.shape
+        
+        with torch.no_grad():
+            baselines = torch.randn(
+                inputs.shape, generator=generator, device=inputs.device
+            )
+            if seq_len < 2: return baselines
+            
+            all_encoding, _ = net.rnn(inputs[:, :-1])
+            h = all_encoding.reshape((-1, net.rnn_hidden_size))
+            
+            # same as JointFeatureGenerator.likelihood_distribution for each prefix
+            mu_std = net.dist_predictor(h)
+            mu = mu_std[:, : mu_std.shape[1] // 2]
+            std = mu_std[:, mu_std.shape[1] // 2 :]
+            z = mu + std * torch.randn(mu.shape, generator=generator, device=mu.device)
+            
+            mean = net.mean_generator(z)
+            a = net.cov_generator(z).view(-1, n_features, n_features)
+            covariance = torch.bmm(a, a.transpose(1, 2)) + torch.eye(
+                n_features, device=z.device
+            ).unsqueeze(0) * 1e-5
+            
+            # reparameterized multivariate normal sample
+            noise = torch.randn(mean.shape, generator=generator, device=mean.device)
+            sample = mean + torch.bmm(
+                torch.linalg.cholesky(covariance), noise.unsqueeze(-1)
+            ).squeeze(-1)
+            
+            baselines[:, 1:] = sample.reshape((batch_size, seq_len - 1, n_features))
+        return baselines.float()
+
+def get_baseline(inputs, mode='random', generator=None, bank=None):
+    """
+    Baselines with the same shape as inputs, generated on the inputs device.
+    The aug and normal modes sample from the feature distribution of the
+    batch, or of the whole split if a BaselineBank is given. The gen mode
+    samples from the BaselineGenerator given as bank.
+    """
     if type(inputs) == tuple:
-        return tuple([get_baseline(input, mode) for input in inputs])
+        return tuple([
+            get_baseline(
+                input, mode, generator, 
+                None if bank is None else bank[input_index]
+            ) for input_index, input in enumerate(inputs)
+        ])
     
     batch_size, seq_len, n_features = inputs.shape[0], inputs.shape[1], inputs.shape[2]    
     device = inputs.device
     
     if mode =='zero': baselines = torch.zeros_like(inputs, device=device).float()
     elif mode == 'random': 
-        baselines = torch.randn_like(inputs, device=device).float()
+        baselines = torch.randn(
+            inputs.shape, generator=generator, device=device
+        ).float()
         # baselines = torch.normal(0, 1.2, size=inputs.shape, device=device).float()
     elif mode == 'aug':
-        inputs = inputs.reshape((-1, n_features))
-        baselines = torch.zeros_like(inputs, device=device).float()
-        
-        for f in range(n_features):
-            choices = inputs[:, f]
-            sampled_index = np.random.choice(
-                range(inputs.shape[0]), size=inputs.shape[0], replace=True
-            )
-            baselines[:, f] = choices[sampled_index]
-        baselines = baselines.reshape((batch_size, seq_len, n_features))
+        values = inputs.reshape((-1, n_features)) if bank is None else bank.values
+        # each feature is sampled with replacement from its own values
+        sampled_index = torch.randint(
+            values.shape[0], (batch_size * seq_len, n_features), 
+            generator=generator, device=device
+        )
+        baselines = values.gather(0, sampled_index).reshape(
+            (batch_size, seq_len, n_features)
+        ).float()
     elif mode == 'normal':
-        means = torch.mean(inputs, dim=(0, 1), keepdim=True).repeat(batch_size, seq_len, 1)
-        std = torch.std(inputs, dim=(0, 1), keepdim=True).repeat(batch_size, seq_len, 1)
+        if bank is None:
+            means = torch.mean(inputs, dim=(0, 1))
+            std = torch.std(inputs, dim=(0, 1))
+        else: means, std = bank.means, bank.std
         
-        baselines = torch.normal(means, std).float()
-        # .repeat(
-        #     batch_size, inputs.shape[1], 1
-        # ).float()
+        baselines = torch.normal(
+            means.expand(inputs.shape), std.expand(inputs.shape), generator=generator
+        ).float()
     elif mode == 'mean': 
         baselines = torch.mean(
                 inputs, axis=0
         ).repeat(batch_size, 1, 1).float()
         
     elif mode == 'gen':
-        trainer = Trainer(
-            logger=False, enable_checkpointing=False,
-            enable_progress_bar=False, max_epochs=100,
-            enable_model_summary=False,accelerator='auto',
-            callbacks=[EarlyStopping('train_loss', patience=5, mode='min', verbose=False)],
-            # precision='64'
+        # without a pretrained generator, one is trained on this batch only
+        if bank is None: bank = BaselineGenerator(inputs, batch_size=batch_size)
+        baselines = bank.sample(inputs, generator=generator)
+    else:
+        print(f'baseline mode options: [zero, random, aug, mean, normal]')
+        raise NotImplementedError
+    
+    return baselines
+
+def gatemask_net(forward_func, n_features):
+    return GateMaskNet(
+        forward_func=forward_func,
+        model=torch.nn.Sequential(
+            RNN(
+                input_size=n_features,
+                rnn="gru",
+                hidden_size=n_features,
+                bidirectional=True,
+            ),
+            MLP([2 * n_features, n_features]),
+        ),
+        lambda_1=1,  # 0.1 for our lambda is suitable
+        lambda_2=1,
+        optim="adam",
+        lr=0.01,
+    )
+
+def share_mask_attr(attr, inputs, targets):
+    """
+    The mask explainers find one mask for all outputs. It is broadcast over the
+    targets with stride 0, so the attributions aren't copied for every target
+    and evaluation can score them once.
+    
+    Returns:
+        batch_size x targets x seq_len x features view, or a tuple of them.
+    """
+    attr = attr.unsqueeze(1).expand(-1, targets, -1, -1)
+    
+    if type(inputs) == tuple:
+        # only the first input is explained, the rest get zero attributions
+        attr = tuple([attr] + [
+            torch.zeros(
+                (inputs[i].shape[0], 1, inputs[i].shape[1], inputs[i].shape[2]), 
+                device=inputs[i].device).expand(-1, targets, -1, -1) 
+            for i in range(1, len(inputs))]
         )
-        generator = JointFeatureGeneratorNet()
-        n_features = inputs.shape[-1]
-        generator.net.init(feature_size=n_features)
-        generator.net.to(device)
-        generator.to(device)
+    return attr
+
+def concat_batches(values):
+    # tensors are concatenated, other values are the same for all batches
+    if isinstance(values[0], torch.Tensor): return torch.cat(values)
+    if type(values[0]) == tuple: 
+        return tuple([concat_batches(value) for value in zip(*values)])
+    return values[0]
+
+class MaskTrainer:
+    """
+    Trains the masks of dyna_mask, extremal_mask or gatemask with one trainer and 
+    mask network kept for all batches, instead of building and training both from 
+    scratch for every batch. Each fit is warm started from the previous one: the
+    networks shared by all samples (the perturbation model and trend networks of 
+    gatemask) keep their weights and the sample masks start from the previous mean mask.
+    
+    Args:
+        name: dyna_mask, extremal_mask or gatemask.
+        explainer: the DynaMask, ExtremalMask or GateMask explainer.
+        args: experiment arguments. The masks of mask_train_batches batches 
+            are trained at once as one dataset.
+    """
+    def __init__(self, name, explainer, args):
+        self.name = name
+        self.batch_size = args.batch_size
+        self.train_batches = args.mask_train_batches
+        # same number of epochs as the per batch trainers
+        self.max_epochs = 50 if name == 'gatemask' else 100
         
-        dataloader = DataLoader(
-            TensorDataset(inputs),
-            batch_size=batch_size,
+        forward_func = explainer.forward_func
+        if name == 'dyna_mask':
+            self.mask_net = MaskNet(forward_func=forward_func)
+            # increased every epoch, reset before each fit
+            self.size_reg_factor = self.mask_net.net.size_reg_factor
+            self.loss_reduction = self.mask_net._loss.reduction
+        elif name == 'extremal_mask':
+            self.mask_net = ExtremalMaskNet(forward_func=forward_func)
+        else:
+            self.mask_net = gatemask_net(forward_func, args.n_features)
+            
+        # warm started fits converge early, so all methods stop on the train loss
+        self.trainer = MaskOptimizer(
+            max_epochs=self.max_epochs, patience=10, compile=args.compile_masks
         )
-        # Train generator
-        trainer.fit(
-            generator, train_dataloaders=dataloader
+        self.initial_mask = None
+        # (data, attr) of the batches fitted ahead by prefit, in batch order
+        self.fitted = []
+        
+    def split_inputs(self, inputs, baselines, additional_forward_args):
+        # only the first input is explained, the others are passed as forward args
+        if type(inputs) == tuple:
+            additional_forward_args = tuple(inputs[1:]) + additional_forward_args
+            inputs = inputs[0]
+            if type(baselines) == tuple: baselines = baselines[0]
+        
+        # extremal_mask is used without baselines, which tint sets to zero
+        if self.name == 'extremal_mask': baselines = 0
+        return inputs, baselines, additional_forward_args
+    
+    def fit(self, data, baseline, additional_forward_args):
+        """
+        Trains the masks of the samples in data.
+        
+        Returns:
+            batch_size x seq_len x features attributions.
+        """
+        net = self.mask_net.net
+        if self.name == 'dyna_mask':
+            # the representation changes the loss reduction to get the loss per sample
+            self.mask_net._loss.reduction = self.loss_reduction
+            net.size_reg_factor = self.size_reg_factor
+            net.init(shape=data.shape, n_epochs=self.max_epochs, batch_size=self.batch_size)
+            tensors = (data, data)
+        elif self.name == 'extremal_mask':
+            net.init(input_size=data.shape, batch_size=self.batch_size)
+            tensors = (data, data, baseline, None)
+        else:
+            net.init(
+                input_size=data.shape, batch_size=self.batch_size, 
+                win_size=5, sigma=0.5, n_epochs=self.max_epochs
+            )
+            tensors = (data, data, baseline, None)
+        
+        if self.initial_mask is not None:
+            net.mask.data.copy_(self.initial_mask.expand_as(net.mask))
+        
+        if additional_forward_args is None: additional_forward_args = (None, )
+        dataloader = DataLoader(
+            MaskDataset(*tensors, *additional_forward_args),
+            batch_size=self.batch_size, collate_fn=default_collate
         )
-        generator.eval()
-        generator.net.to(device)
         
-        baselines = torch.randn_like(inputs, device=device).float()
-        for t in range(1, inputs.shape[1]):
-            baselines[:, t] = generator.net.forward(inputs[:, :t])
-    else:
-        print(f'baseline mode options: [zero, random, aug, mean, normal]')
-        raise NotImplementedError
+        self.trainer.fit(self.mask_net, train_dataloaders=dataloader)
+        
+        self.mask_net.eval()
+        self.mask_net.to(data.device)
+        if self.name == 'dyna_mask':
+            attr, _ = DynaMask.representation(self.mask_net, self.trainer, dataloader)
+        elif self.name == 'extremal_mask':
+            attr = net.representation()
+        else:
+            attr = net.representation(data)
+            
+        self.initial_mask = net.mask.detach().mean(dim=0)
+        return attr.to(data.device)
     
-    return baselines
+    def prefit(self, batches):
+        """
+        Fits the masks of train_batches batches at once, then yields the batches.
+        
+        Args:
+            batches: iterator of (batch_index, inputs, baselines, additional_forward_args).
+        """
+        batches = iter(batches)
+        while True:
+            group = list(islice(batches, self.train_batches))
+            if len(group) == 0: return
+            
+            if len(group) > 1:
+                splits = [
+                    self.split_inputs(inputs, baselines, additional_forward_args)
+                    for _, inputs, baselines, additional_forward_args in group
+                ]
+                data, baseline, additional_forward_args = [
+                    concat_batches(values) for values in zip(*splits)
+                ]
+                attr = self.fit(data, baseline, additional_forward_args)
+                self.fitted = list(zip(
+                    [split[0] for split in splits], 
+                    attr.split([len(split[0]) for split in splits])
+                ))
+            yield from group
+    
+    def attribute(self, inputs, baselines, additional_forward_args):
+        data, baseline, additional_forward_args = self.split_inputs(
+            inputs, baselines, additional_forward_args
+        )
+        # batches fitted ahead are matched by their input tensor
+        if len(self.fitted) > 0 and self.fitted[0][0] is data:
+            return self.fitted.pop(0)[1]
+        
+        self.fitted = []
+        return self.fit(data, baseline, additional_forward_args)
 
 def compute_attr_with_trainer(
     inputs, explainer,
-    additional_forward_args, targets
-): # the parameters ensure Trainer doesn't flood the output with logs and create log folders
-    trainer = Trainer(
-        logger=False, enable_checkpointing=False,
-        enable_progress_bar=False, max_epochs=100,accelerator="gpu",
-        enable_model_summary=False
-    )
+    additional_forward_args, args, targets
+):
+    if isinstance(explainer, MaskTrainer):
+        attr = explainer.attribute(inputs, None, additional_forward_args)
+        return share_mask_attr(attr, inputs, targets)
+    
+    trainer = MaskOptimizer(max_epochs=100, compile=args.compile_masks)
     if type(inputs) == tuple:
         new_additional_forward_args = tuple([
             input for input in inputs[1:]
@@ -108,15 +411,6 @@ def compute_attr_with_trainer(
             additional_forward_args=new_additional_forward_args,
             trainer=trainer
         )
-        # output isn't for each target, unlike other methods
-        # batch_size x seq_len x features -> (targets x batch_size) x seq_len x features
-        attr = attr.repeat(targets, 1, 1)
-        
-        attr = tuple([attr] + [
-            torch.zeros(
-                (inputs[i].shape[0]*targets, inputs[i].shape[1], inputs[i].shape[2]), 
-                device=inputs[i].device) for i in range(1, len(inputs))]
-        )
     else: 
         # batch_size x seq_len x features
         attr = explainer.attribute(
@@ -124,40 +418,19 @@ def compute_attr_with_trainer(
             additional_forward_args=additional_forward_args,
             trainer=trainer
         )
-        # output isn't for each target, unlike other methods
-        # batch_size x seq_len x features -> (targets x batch_size) x seq_len x features
-        attr = attr.repeat(targets, 1, 1)
         
-    return attr
+    return share_mask_attr(attr, inputs, targets)
 
 def compute_attr_with_gatemask(
     inputs, baselines, explainer,
     additional_forward_args, args, targets
 ): 
-    trainer = Trainer(
-        logger=False, enable_checkpointing=False,
-        enable_progress_bar=False, max_epochs=50,
-        enable_model_summary=False,accelerator="auto",
-        callbacks=[EarlyStopping('train_loss', patience=10, mode='min', verbose=False)],
-    )
-    
-    mask = GateMaskNet(
-        forward_func=explainer.forward_func,
-        model=torch.nn.Sequential(
-            RNN(
-                input_size=args.n_features,
-                rnn="gru",
-                hidden_size=args.n_features,
-                bidirectional=True,
-            ),
-            MLP([2 * args.n_features, args.n_features]),
-        ),
-        lambda_1=1,  # 0.1 for our lambda is suitable
-        lambda_2=1,
-        optim="adam",
-        lr=0.01,
-    )
+    if isinstance(explainer, MaskTrainer):
+        attr = explainer.attribute(inputs, baselines, additional_forward_args)
+        return share_mask_attr(attr, inputs, targets)
     
+    trainer = MaskOptimizer(max_epochs=50, patience=10, compile=args.compile_masks)
+    mask = gatemask_net(explainer.forward_func, args.n_features)
     
     if type(inputs) == tuple:
         new_additional_forward_args = tuple([
@@ -174,15 +447,6 @@ def compute_attr_with_gatemask(
             batch_size=args.batch_size,
             trainer=trainer
         )
-        # output isn't for each target, unlike other methods
-        # batch_size x seq_len x features -> (targets x batch_size) x seq_len x features
-        attr = attr.repeat(targets, 1, 1)
-        
-        attr = tuple([attr] + [
-            torch.zeros(
-                (inputs[i].shape[0]*targets, inputs[i].shape[1], inputs[i].shape[2]), 
-                device=inputs[i].device) for i in range(1, len(inputs))]
-        )
     else: 
         mask.to(inputs.device)
         # batch_size x seq_len x features
@@ -194,16 +458,167 @@ def compute_attr_with_gatemask(
             batch_size=args.batch_size,
             trainer=trainer
         )
-        # output isn't for each target, unlike other methods
-        # batch_size x seq_len x features -> (targets x batch_size) x seq_len x features
-        attr = attr.repeat(targets, 1, 1)
         
-    return attr
+    return share_mask_attr(attr, inputs, targets)
+
+def gradients_all_targets(
+    forward_func, inputs, additional_forward_args, targets
+):
+    """
+    Gradients of every output target w.r.t. the inputs from a single forward pass.
+    The backward pass is batched over one-hot grad_outputs, one per target.
+
+    Returns: tuple of targets x batch x seq_len x features
+    """
+    if additional_forward_args is None: additional_forward_args = ()
+
+    with torch.enable_grad():
+        inputs = tuple(input.detach().requires_grad_() for input in inputs)
+        outputs = forward_func(*inputs, *additional_forward_args)
+        # each target must be a single output, same as captum
+        outputs = outputs.reshape((len(outputs), -1))
+        assert outputs.shape[1] == targets, \
+            f'Expected {targets} outputs per sample, got {outputs.shape[1]}'
+
+        # targets x batch x targets, one-hot over the last dimension
+        grad_outputs = torch.eye(
+            targets, device=outputs.device, dtype=outputs.dtype
+        ).unsqueeze(1).repeat(1, len(outputs), 1)
+
+        try:
+            grads = torch.autograd.grad(
+                outputs, inputs, grad_outputs=grad_outputs,
+                is_grads_batched=True, allow_unused=True
+            )
+        except RuntimeError:
+            # some backward ops don't support vmap (e.g. cudnn RNN)
+            grads_list = [
+                torch.autograd.grad(
+                    outputs, inputs, grad_outputs=grad_outputs[target],
+                    retain_graph=True, allow_unused=True
+                ) for target in range(targets)
+            ]
+            grads = tuple(
+                None if grads_list[0][i] is None else
+                torch.stack([grad[i] for grad in grads_list])
+                for i in range(len(inputs))
+            )
+
+    return tuple(
+        torch.zeros((targets, ) + input.shape, device=input.device)
+        if grad is None else grad.detach()
+        for input, grad in zip(inputs, grads)
+    )
+
+def gradient_attr_all_targets(
+    name, forward_func, inputs, baselines,
+    additional_forward_args, targets,
+    n_steps=50, n_samples=5
+):
+    """
+    Integrated gradients or gradient shap for all output targets at once. Instead
+    of running the integration path once per target, the path is evaluated
+    once and the gradients of all targets are taken from it.
+
+    Returns: batch x targets x seq_len x features or a tuple of them
+    """
+    input_is_tuple = type(inputs) == tuple
+    if not input_is_tuple:
+        inputs, baselines = (inputs, ), (baselines, )
+    baselines = _format_baseline(baselines, inputs)
+    additional_forward_args = _format_additional_forward_args(additional_forward_args)
+    batch_size = inputs[0].shape[0]
+
+    if name == 'integrated_gradients':
+        step_sizes_func, alphas_func = approximation_parameters('gausslegendre')
+        step_sizes, alphas = step_sizes_func(n_steps), alphas_func(n_steps)
+
+        # (n_steps x batch) x seq_len x features
+        scaled_inputs = tuple(
+            torch.cat([baseline + alpha * (input - baseline) for alpha in alphas], dim=0)
+            for input, baseline in zip(inputs, baselines)
+        )
+        grads = gradients_all_targets(
+            forward_func, scaled_inputs,
+            _expand_additional_forward_args(additional_forward_args, n_steps),
+            targets
+        )
+        step_sizes = torch.tensor(step_sizes, device=inputs[0].device).float()
+        attr = tuple(
+            torch.einsum(
+                's,tsb...->tb...', step_sizes,
+                grad.reshape((targets, n_steps) + input.shape)
+            ) * (input - baseline)
+            for grad, input, baseline in zip(grads, inputs, baselines)
+        )
+
+    elif name == 'gradient_shap':
+        # same as captum, a random baseline and a random point on the path per sample
+        baseline_index = np.random.choice(batch_size, batch_size * n_samples)
+        rand_coefficient = torch.tensor(
+            np.random.uniform(0.0, 1.0, batch_size * n_samples),
+            device=inputs[0].device
+        ).float()
+
+        # (n_samples x batch) x seq_len x features
+        expanded_inputs = tuple(
+            torch.cat([input] * n_samples, dim=0) for input in inputs
+        )
+        sampled_baselines = tuple(
+            baseline[baseline_index] if isinstance(baseline, torch.Tensor)
+            else baseline for baseline in baselines
+        )
+        scaled_inputs = tuple(
+            baseline + rand_coefficient.reshape(
+                (-1, ) + (1, ) * (len(input.shape) - 1)
+            ) * (input - baseline)
+            for input, baseline in zip(expanded_inputs, sampled_baselines)
+        )
+        grads = gradients_all_targets(
+            forward_func, scaled_inputs,
+            _expand_additional_forward_args(additional_forward_args, n_samples),
+            targets
+        )
+        attr = tuple(
+            (grad * (input - baseline)).reshape(
+                (targets, n_samples, batch_size) + input.shape[1:]
+            ).mean(dim=1)
+            for grad, input, baseline in zip(grads, expanded_inputs, sampled_baselines)
+        )
+    else:
+        raise NotImplementedError(f'Batched gradients are not implemented for {name}')
+
+    # targets x batch x seq_len x features -> batch x targets x seq_len x features
+    attr = tuple(a.transpose(0, 1) for a in attr)
+    if input_is_tuple: return attr
+    else: return attr[0]
 
 def compute_attr_with_gradient(
     name, inputs, baselines, explainer,
     additional_forward_args, args, targets
-): 
+):
+    if args.vectorize_targets and name in ['integrated_gradients', 'gradient_shap']:
+        # these models use the multiple inputs in the forward function
+        if type(inputs) == tuple and args.model not in dual_input_users:
+            new_additional_forward_args = tuple([
+                input for input in inputs[1:]
+            ]) + additional_forward_args
+
+            attr = gradient_attr_all_targets(
+                name, explainer.forward_func, inputs[0], baselines[0],
+                new_additional_forward_args, targets
+            )
+            attr = tuple([attr] + [
+                torch.zeros(
+                    (inputs[i].shape[0], targets) + inputs[i].shape[1:], 
+                    device=inputs[i].device) for i in range(1, len(inputs))]
+            )
+        else: attr = gradient_attr_all_targets(
+            name, explainer.forward_func, inputs, baselines,
+            additional_forward_args, targets
+        )
+        return attr
+
     attr_list = []
         
     for target in range(targets):
@@ -310,7 +725,7 @@ def compute_attr(
     elif name in ['dyna_mask', 'extremal_mask']:
         attr = compute_attr_with_trainer(
             inputs, explainer,
-            additional_forward_args, targets
+            additional_forward_args, args, targets
         )
         
     elif name == 'fit':
@@ -0,0 +1,150 @@
+import torch, hashlib
+from collections import OrderedDict
+
+class ForwardCache(torch.nn.Module):
+    """
+    Wraps the model forward with a size-bounded LRU cache of the outputs of each
+    sample. Entries are keyed by a blake2b digest of the sample's row in every
+    forward argument, or by integer hashes computed on the device for gpu
+    arguments, so the same perturbation of the same sample against the same
+    baseline is only forwarded once, even across explainers that stack their
+    perturbations differently. Only the samples missing from the cache are
+    forwarded. Only used when gradients are disabled, since the cached outputs
+    don't have a graph.
+
+    Args:
+        model: the model to wrap.
+        max_mb: max size of the cached outputs in megabytes. 0 disables caching.
+    """
+    def __init__(self, model, max_mb=0):
+        super().__init__()
+        self.model = model
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.entries = OrderedDict()
+        self.n_bytes = 0
+        # independent hashes of each argument row in the key
+        self.n_hashes = 6
+        self.weights = dict()
+        self.reset_stats()
+
+    def reset_stats(self):
+        # counted per sample, not per forward call
+        self.hits, self.misses = 0, 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        hit_rate = 100.0 * self.hits / total if total > 0 else 0
+        return f'Forward cache: {self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate), ' \
+            f'{len(self.entries)} entries, {self.n_bytes / (1024 * 1024):.1f} MB.'
+
+    def hash_weights(self, n_columns, device):
+        # fixed random integer weights, the same in every run and process
+        key = (n_columns, str(device))
+        if key not in self.weights:
+            generator = torch.Generator().manual_seed(0)
+            self.weights[key] = torch.randint(
+                0, 1 << 20, (n_columns, self.n_hashes), generator=generator
+            ).to(device=device, dtype=torch.float64)
+        return self.weights[key]
+
+    def row_hashes(self, tensor, chunk_columns=4096):
+        """
+        Exact integer hashes of each row's bytes, computed on the tensor's device.
+        The bytes are read as 16 bit words, and each hash is a sum of the words
+        times random weights below 2^20. Every partial sum stays below 2^53, so the
+        float64 matmul is exact. Different rows share a hash with probability at most
+        2^-20, so all n_hashes of them with at most 2^(-20 * n_hashes).
+        """
+        rows = tensor.detach().contiguous().reshape((len(tensor), -1))
+        # the dtype is part of the key prefix, so the value conversion is exact
+        if rows.element_size() == 1: rows = rows.to(torch.int16)
+        words = rows.view(torch.int16).to(torch.int32) & 0xFFFF
+
+        weights = self.hash_weights(words.shape[1], words.device)
+        hashes = torch.zeros((len(words), self.n_hashes), dtype=torch.int64, device=words.device)
+        for start in range(0, words.shape[1], chunk_columns):
+            end = start + chunk_columns
+            hashes += (words[:, start:end].to(torch.float64) @ weights[start:end]).to(torch.int64)
+        return hashes
+
+    def row_keys(self, args):
+        """
+        Key of each sample's contents over all arguments. None if the arguments
+        don't share the same number of samples, then the forward isn't cached.
+        """
+        tensors = [arg for arg in args if isinstance(arg, torch.Tensor)]
+        if len(tensors) == 0 or any(
+            tensor.dim() == 0 or len(tensor) != len(tensors[0]) for tensor in tensors
+        ):
+            return None
+
+        # the arguments that aren't samples are the same for every row
+        prefix = hashlib.blake2b(repr([
+            (tuple(arg.shape[1:]), arg.dtype) if isinstance(arg, torch.Tensor) else arg
+            for arg in args
+        ]).encode(), digest_size=16).digest()
+
+        if all(tensor.device.type == 'cpu' for tensor in tensors):
+            # no copy needed on the host, where hashing the bytes is faster than the matmul
+            rows = [tensor.detach().reshape((len(tensor), -1)).numpy() for tensor in tensors]
+            keys = []
+            for row_index in range(len(tensors[0])):
+                digest = hashlib.blake2b(prefix, digest_size=16)
+                for row in rows:
+                    digest.update(row[row_index].tobytes())
+                keys.append(digest.digest())
+            return keys
+
+        # only the hashes are copied to the host, not the arguments
+        hashes = torch.cat([
+            self.row_hashes(tensor).to(tensors[0].device) for tensor in tensors
+        ], dim=1).cpu().numpy()
+        return [prefix + row.tobytes() for row in hashes]
+
+    def add(self, key, output):
+        n_bytes = output.numel() * output.element_size()
+        if n_bytes > self.max_bytes: return
+
+        self.entries[key] = output
+        self.n_bytes += n_bytes
+        while self.n_bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.n_bytes -= evicted.numel() * evicted.element_size()
+
+    def forward(self, *args):
+        if self.max_bytes <= 0 or torch.is_grad_enabled():
+            return self.model(*args)
+
+        keys = self.row_keys(args)
+        if keys is None: return self.model(*args)
+
+        # the first row of each missing key is forwarded, duplicate rows reuse its output
+        missing = OrderedDict()
+        for row_index, key in enumerate(keys):
+            if key in self.entries:
+                self.entries.move_to_end(key)
+            elif key not in missing:
+                missing[key] = row_index
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+
+        device = next(arg.device for arg in args if isinstance(arg, torch.Tensor))
+        cached = {key: self.entries[key] for key in keys if key in self.entries}
+        if len(missing) > 0:
+            missing_rows = torch.tensor(list(missing.values()), device=device)
+            outputs = self.model(*[
+                arg.index_select(0, missing_rows) if isinstance(arg, torch.Tensor) else arg
+                for arg in args
+            ])
+            if len(outputs) != len(missing):
+                # the outputs aren't per sample, so can't be cached
+                return outputs if len(missing) == len(keys) else self.model(*args)
+
+            for key, output in zip(missing, outputs.detach().cpu()):
+                cached[key] = output
+                self.add(key, output.clone())
+
+            if len(missing) == len(keys):
+                return outputs
+
+        return torch.stack([cached[key] for key in keys]).to(device)
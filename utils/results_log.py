@@ -0,0 +1,243 @@
+import os, json
+import numpy as np
+import pandas as pd
+
+# one fixed width record per result row, metric names are stored as codes
+record_dtype = np.dtype([
+    ('batch_index', '<i8'), ('metric', '<i2'), ('tau', '<i4'),
+    ('area', '<f8'), ('comp', '<f8'), ('suff', '<f8')
+])
+columns = ['batch_index', 'metric', 'tau', 'area', 'comp', 'suff']
+
+class ResultsLog:
+    """
+    Append-only binary log of the batch results. The file only has the fixed width
+    records of all batches, a batch is appended after the records of the earlier ones.
+    A sidecar index file (path + '.idx') has one json line per completed batch,
+    [batch_index, start row, number of rows], and one line per metric name, the
+    metric codes being the order of those lines. Appending a batch never rewrites
+    earlier bytes of either file, so a job killed while writing can lose at most
+    the batch being written.
+
+    A batch is complete once its index line is written. When opening the log, rows
+    past the last indexed batch are either indexed again from their batch_index
+    (the index line of a batch was lost), or truncated (the last batch was only
+    partly written), so the run resumes after the last complete batch.
+
+    Args:
+        path: log file path.
+        overwrite: start a new log even if the file exists.
+    """
+    def __init__(self, path, overwrite=False):
+        self.path = path
+        if overwrite or not os.path.exists(path):
+            self.metrics, self.batches = [], []
+            self.file = open(path, 'w+b')
+            self.index_file = open(ResultsLog.index_path(path), 'w')
+        else:
+            self.metrics, self.batches, index_complete = ResultsLog.read_index(path)
+            self.file = open(path, 'r+b')
+            self.recover(index_complete)
+            self.index_file = open(ResultsLog.index_path(path), 'a')
+
+        # the metrics of the index file, new metrics are written before their records
+        self.n_indexed_metrics = len(self.metrics)
+
+    @staticmethod
+    def index_path(path):
+        return path + '.idx'
+
+    @staticmethod
+    def read_index(path):
+        """
+        The metric names and batches [batch_index, start, n_rows] of the index file,
+        and whether all its lines are valid. Stops at the first invalid line, which
+        is a line only partly written.
+        """
+        metrics, batches = [], []
+        if not os.path.exists(ResultsLog.index_path(path)):
+            return metrics, batches, False
+
+        with open(ResultsLog.index_path(path)) as file:
+            for line in file:
+                if not line.endswith('\n'): return metrics, batches, False
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    return metrics, batches, False
+
+                if isinstance(entry, str): metrics.append(entry)
+                else: batches.append(entry)
+        return metrics, batches, True
+
+    @staticmethod
+    def last_batch(path, block_size=4096):
+        """
+        Last completed batch index of the log, None if no batch was written.
+        Only the end of the index file is read, back to its last complete batch line.
+        """
+        # the rows past the index aren't checked, they are recovered when opening the log
+        index_path = ResultsLog.index_path(path)
+        if not os.path.exists(index_path): return None
+
+        with open(index_path, 'rb') as file:
+            position = file.seek(0, os.SEEK_END)
+            # bytes after the last newline are a partly written line
+            tail = b''
+            while position > 0:
+                read_size = min(block_size, position)
+                position -= read_size
+                file.seek(position)
+                tail = file.read(read_size) + tail
+
+                lines = tail.split(b'\n')
+                # the first piece may be cut by the block, unless the file start is reached
+                complete = lines[:-1] if position == 0 else lines[1:-1]
+                for line in reversed(complete):
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    # metric names are strings, batches are [batch_index, start, n_rows]
+                    if isinstance(entry, list): return entry[0]
+                # the cut first piece ends with a newline, so is complete once the next block is read
+                tail = lines[0] + b'\n' if position > 0 else b''
+        return None
+
+    @staticmethod
+    def remove(path):
+        for file_path in [path, ResultsLog.index_path(path)]:
+            if os.path.exists(file_path): os.remove(file_path)
+
+    def recover(self, index_complete=True):
+        """
+        Indexes again the complete batches written after the last indexed one,
+        then truncates the rows after them. Each batch is written contiguously, so
+        a change of batch_index ends a batch. The last batch can't be known to be
+        complete without its index line and is truncated to be run again.
+        """
+        n_written = os.path.getsize(self.path) // record_dtype.itemsize
+        # only batches whose rows were all written, in case the index is ahead
+        n_indexed = len(self.batches)
+        while len(self.batches) > 0 and self.n_rows > n_written:
+            self.batches.pop()
+
+        start = self.n_rows
+        recovered = []
+        if n_written > start:
+            records = np.array(np.memmap(
+                self.path, dtype=record_dtype, mode='r', shape=(n_written, )
+            )[start:])
+            ends = np.flatnonzero(np.diff(records['batch_index']) != 0) + 1
+            for begin, end in zip(np.r_[0, ends[:-1]], ends):
+                # the metric names are indexed before their records, unless the index was lost
+                if records['metric'][begin:end].max() >= len(self.metrics): break
+                recovered.append([
+                    int(records['batch_index'][begin]), int(start + begin), int(end - begin)
+                ])
+
+        self.batches.extend(recovered)
+        if os.path.getsize(self.path) != self.n_rows * record_dtype.itemsize:
+            print(
+                f'Recovered {len(recovered)} batches of {self.path} missing from its index, '
+                f'truncated the rows after batch {self.last_batch_index}'
+            )
+            self.file.truncate(self.n_rows * record_dtype.itemsize)
+
+        if not index_complete or len(self.batches) != n_indexed or len(recovered) > 0:
+            # the index is written again without the partly written lines
+            with open(ResultsLog.index_path(self.path), 'w') as index_file:
+                for entry in self.metrics + self.batches:
+                    index_file.write(json.dumps(entry) + '\n')
+
+    @property
+    def last_batch_index(self):
+        return self.batches[-1][0] if len(self.batches) > 0 else None
+
+    @property
+    def n_rows(self):
+        if len(self.batches) == 0: return 0
+        return self.batches[-1][1] + self.batches[-1][2]
+
+    def _write_index(self, entries):
+        for entry in entries:
+            self.index_file.write(json.dumps(entry) + '\n')
+        self.index_file.flush()
+
+    def append(self, batch_index, rows):
+        """Appends the rows [batch_index, metric, tau, area, comp, suff] of a batch."""
+        records = np.zeros(len(rows), dtype=record_dtype)
+        for i, (_, metric, tau, area, comp, suff) in enumerate(rows):
+            if metric not in self.metrics: self.metrics.append(metric)
+            records[i] = (batch_index, self.metrics.index(metric), tau, area, comp, suff)
+
+        self.append_records(batch_index, records)
+
+    def append_records(self, batch_index, records):
+        # the metric names are indexed before the records with their codes
+        self._write_index(self.metrics[self.n_indexed_metrics:])
+        self.n_indexed_metrics = len(self.metrics)
+
+        self.file.seek(self.n_rows * record_dtype.itemsize)
+        self.file.write(records.tobytes())
+        self.file.flush()
+
+        # the batch is complete once its index line is written
+        batch = [int(batch_index), self.n_rows, len(records)]
+        self._write_index([batch])
+        self.batches.append(batch)
+
+    def extend(self, other, end=None):
+        """
+        Appends the batches of another log, in their order. Batches up to the last
+        batch of this log or from end onwards are skipped, so no batch is logged twice.
+        """
+        records = other.records()
+        for batch_index, start, n_rows in other.batches:
+            if self.last_batch_index is not None and batch_index <= self.last_batch_index: continue
+            if end is not None and batch_index >= end: continue
+            batch_records = np.array(records[start:start + n_rows])
+            for metric_code, metric in enumerate(other.metrics):
+                if metric not in self.metrics: self.metrics.append(metric)
+                batch_records['metric'][
+                    records['metric'][start:start + n_rows] == metric_code
+                ] = self.metrics.index(metric)
+            self.append_records(batch_index, batch_records)
+
+    def records(self):
+        # lazily read, so the results are never fully loaded in memory
+        if self.n_rows == 0: return np.zeros(0, dtype=record_dtype)
+        return np.memmap(self.path, dtype=record_dtype, mode='r', shape=(self.n_rows, ))
+
+    def iter_dataframes(self, chunk_rows=1000000):
+        records = self.records()
+        for start in range(0, len(records), chunk_rows):
+            df = pd.DataFrame(np.array(records[start:start + chunk_rows]))
+            df['metric'] = np.array(self.metrics, dtype=object)[df['metric'].values]
+            yield df[columns]
+
+    def aggregate(self):
+        """Streaming equivalent of grouping the results by (metric, area) and taking the mean."""
+        total = None
+        for df in self.iter_dataframes():
+            chunk = df.groupby(['metric', 'area'])[['comp', 'suff']].aggregate(['sum', 'count'])
+            total = chunk if total is None else total.add(chunk, fill_value=0)
+
+        if total is None:
+            return pd.DataFrame(columns=['metric', 'area', 'comp', 'suff'])
+
+        means = pd.DataFrame({
+            column: total[(column, 'sum')] / total[(column, 'count')]
+            for column in ['comp', 'suff']
+        })
+        return means.sort_index().reset_index()
+
+    def to_csv(self, path):
+        with open(path, 'w', newline='') as file:
+            file.write(','.join(columns) + '\n')
+            for df in self.iter_dataframes():
+                df.round(6).to_csv(file, index=False, header=False)
+
+    def close(self):
+        self.file.close()
+        self.index_file.close()
@@ -1,3 +1,4 @@
+import warnings
 import pandas as pd
 import numpy as np
 
@@ -578,4 +579,132 @@ def load_from_tsfile_to_dataframe(
         else:
             return data
     else:
-        raise OSError("empty file")
\ No newline at end of file
+        raise OSError("empty file")
+
+def stack_ragged(dimension_values, lengths):
+    """Stack the values of each dimension into one (total length, dimensions) array.
+
+    Parameters
+    ----------
+    dimension_values: list of ndarray
+        For each dimension, the values of all cases back to back.
+    lengths: ndarray
+        (cases, dimensions) length of each series.
+
+    Returns
+    -------
+    values: ndarray
+        (total length, dimensions) float array, case i at rows
+        offsets[i]:offsets[i+1]. Dimensions shorter than their case are
+        padded with NaN at the end.
+    offsets: ndarray
+        (cases + 1, ) start row of each case.
+    """
+    case_lengths = lengths.max(axis=1)
+    offsets = np.concatenate([[0], np.cumsum(case_lengths)]).astype(np.int64)
+    values = np.full((offsets[-1], lengths.shape[1]), np.nan)
+
+    for dim, flat in enumerate(dimension_values):
+        if np.array_equal(lengths[:, dim], case_lengths):
+            values[:, dim] = flat
+        else:
+            # row of each value = start of its case + position within its series
+            dim_starts = np.concatenate([[0], np.cumsum(lengths[:, dim])[:-1]])
+            positions = np.arange(len(flat)) - np.repeat(dim_starts, lengths[:, dim])
+            values[np.repeat(offsets[:-1], lengths[:, dim]) + positions, dim] = flat
+
+    return values, offsets
+
+
+def dataframe_to_arrays(data):
+    """Convert the nested DataFrame of load_from_tsfile_to_dataframe to
+    the arrays of stack_ragged, also returning the (cases, dimensions) lengths."""
+    cells = data.values
+    lengths = np.vectorize(len, otypes=[int])(cells).reshape(cells.shape)
+    dimension_values = [
+        np.concatenate([np.asarray(series, dtype=float) for series in cells[:, dim]] + [np.zeros(0)])
+        for dim in range(cells.shape[1])
+    ]
+    return stack_ragged(dimension_values, lengths) + (lengths, )
+
+
+def load_from_tsfile_to_arrays(
+    full_file_path_and_name,
+    replace_missing_vals_with="NaN",
+):
+    """Load the data of a .ts file into dense arrays.
+
+    The @data section is read in bulk and the values of each dimension are
+    parsed with a single numpy call, instead of building a Series per case.
+    Files with timestamps, without class labels or that fail this fast path
+    are loaded with load_from_tsfile_to_dataframe, which also gives the
+    detailed format errors.
+
+    Parameters
+    ----------
+    full_file_path_and_name: str
+        The full pathname of the .ts file to read.
+    replace_missing_vals_with: str
+       The value that missing values in the text file should be replaced
+       with prior to parsing.
+
+    Returns
+    -------
+    values: ndarray
+        (total length, dimensions) float array, see stack_ragged.
+    offsets: ndarray
+        (cases + 1, ) case i is at values[offsets[i]:offsets[i+1]].
+    lengths: ndarray
+        (cases, dimensions) length of each series.
+    class_values: ndarray
+        (cases, ) class value of each case, lowercase like
+        load_from_tsfile_to_dataframe.
+    """
+    with open(full_file_path_and_name, encoding="utf-8") as file:
+        lines = file.read().lower().splitlines()
+
+    arrays = None
+    tags = [line.strip() for line in lines if line.strip().startswith("@")]
+    if "@data" in tags and "@timestamps false" in tags and any(
+        tag.startswith("@classlabel true") for tag in tags
+    ):
+        data_start = [line.strip() for line in lines].index("@data") + 1
+        arrays = _parse_data_section(lines[data_start:], replace_missing_vals_with)
+
+    if arrays is None:
+        data, class_values = load_from_tsfile_to_dataframe(
+            full_file_path_and_name,
+            return_separate_X_and_y=True,
+            replace_missing_vals_with=replace_missing_vals_with,
+        )
+        arrays = dataframe_to_arrays(data) + (class_values, )
+
+    return arrays
+
+
+def _parse_data_section(lines, replace_missing_vals_with):
+    # returns None when the lines are not the plain dim_0:...:dim_n:class format
+    cases = [
+        line.replace("?", replace_missing_vals_with).split(":")
+        for line in (line.strip() for line in lines) if line
+    ]
+    if len(cases) == 0: return None
+
+    num_dimensions = len(cases[0]) - 1
+    if num_dimensions < 1 or any(len(case) != num_dimensions + 1 for case in cases):
+        return None
+
+    class_values = np.asarray([case[-1].strip() for case in cases])
+    dimension_values, lengths = [], np.zeros((len(cases), num_dimensions), dtype=int)
+    for dim in range(num_dimensions):
+        series = [case[dim].strip() for case in cases]
+        lengths[:, dim] = [text.count(",") + 1 if text else 0 for text in series]
+        with warnings.catch_warnings():
+            # a malformed value stops np.fromstring early, caught by the length check
+            warnings.simplefilter("ignore", DeprecationWarning)
+            flat = np.fromstring(",".join(text for text in series if text), sep=",")
+        if len(flat) != lengths[:, dim].sum():
+            return None
+        dimension_values.append(flat)
+
+    return stack_ragged(dimension_values, lengths) + (lengths, class_values)
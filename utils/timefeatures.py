@@ -13,6 +13,8 @@
 # permissions and limitations under the License.
 
 from typing import List
+from collections import OrderedDict
+import hashlib
 
 import numpy as np
 import pandas as pd
@@ -87,6 +89,41 @@ class WeekOfYear(TimeFeature):
         return (index.isocalendar().week - 1) / 52.0 - 0.5
 
 
+class Month(TimeFeature):
+    """Month of year as is, used for timeenc=0"""
+
+    def __call__(self, index: pd.DatetimeIndex) -> np.ndarray:
+        return index.month
+
+
+class Day(TimeFeature):
+    """Day of month as is, used for timeenc=0"""
+
+    def __call__(self, index: pd.DatetimeIndex) -> np.ndarray:
+        return index.day
+
+
+class Weekday(TimeFeature):
+    """Day of week as is, used for timeenc=0"""
+
+    def __call__(self, index: pd.DatetimeIndex) -> np.ndarray:
+        return index.dayofweek
+
+
+class Hour(TimeFeature):
+    """Hour of day as is, used for timeenc=0"""
+
+    def __call__(self, index: pd.DatetimeIndex) -> np.ndarray:
+        return index.hour
+
+
+class QuarterOfHour(TimeFeature):
+    """Minute of hour in 15 minute intervals, used for timeenc=0"""
+
+    def __call__(self, index: pd.DatetimeIndex) -> np.ndarray:
+        return index.minute // 15
+
+
 def time_features_from_frequency_str(freq_str: str) -> List[TimeFeature]:
     """
     Returns a list of time features that will be appropriate for the given frequency string.
@@ -146,3 +183,55 @@ def time_features_from_frequency_str(freq_str: str) -> List[TimeFeature]:
 
 def time_features(dates, freq='h'):
     return np.vstack([feat(dates) for feat in time_features_from_frequency_str(freq)])
+
+
+def calendar_features(minute=False) -> List[TimeFeature]:
+    """
+    Raw calendar features for timeenc=0: month, day, weekday and hour,
+    plus the quarter of the hour if minute is True.
+    """
+    features = [Month(), Day(), Weekday(), Hour()]
+    if minute: features.append(QuarterOfHour())
+    return features
+
+
+# memoized encodings, keyed by the dates content and encoding settings
+_encoded_time_features = OrderedDict()
+_max_encoded_time_features = 16
+
+def encode_time_features(dates, timeenc=0, freq='h', minute=False):
+    """
+    Time features of the dates as a (dates x features) array, computed with
+    DatetimeIndex attributes on the unique dates only. timeenc=0 gives the raw
+    calendar features, timeenc=1 the features for the frequency scaled to [-0.5, 0.5].
+    Results are memoized, so encoding the same dates again only hashes them.
+    """
+    dates = pd.to_datetime(np.asarray(dates)).values
+    key = (
+        hashlib.blake2b(dates.view('i8').tobytes(), digest_size=16).hexdigest(),
+        timeenc, freq if timeenc == 1 else None, minute
+    )
+
+    if key not in _encoded_time_features:
+        unique_dates, date_index = np.unique(dates, return_inverse=True)
+        index = pd.DatetimeIndex(unique_dates)
+
+        if timeenc == 0:
+            features = calendar_features(minute)
+            data_stamp = np.vstack([
+                np.asarray(feat(index), dtype=np.int64) for feat in features
+            ])
+        else:
+            data_stamp = np.vstack([
+                np.asarray(feat(index), dtype=float)
+                for feat in time_features_from_frequency_str(freq)
+            ]).reshape((-1, len(index)))
+
+        _encoded_time_features[key] = data_stamp.transpose(1, 0)[date_index]
+        if len(_encoded_time_features) > _max_encoded_time_features:
+            _encoded_time_features.popitem(last=False)
+    else:
+        _encoded_time_features.move_to_end(key)
+
+    # callers may modify their copy
+    return _encoded_time_features[key].copy()
@@ -28,12 +28,24 @@ def avg_over_output_horizon(attr, inputs, args):
     
     return attr
 
+def is_horizon_shared(attr):
+    """
+    Whether the batch x pred_len x seq_len x features attributions are the same
+    for every output horizon, as a broadcast view with stride 0 over pred_len.
+    """
+    if type(attr) == tuple:
+        return all(is_horizon_shared(attr_) for attr_ in attr)
+    return attr.dim() == 4 and attr.shape[1] > 1 and attr.stride(1) == 0
+
 def round_up(attr, decimals=6):
     if type(attr) == tuple:
         # tuple of batch x seq_len x features
         attr = tuple([
-            torch.round(a, decimals=decimals) for a in attr
+            round_up(a, decimals=decimals) for a in attr
         ])
+    elif is_horizon_shared(attr):
+        # rounded once and broadcast again, instead of materializing every horizon
+        attr = torch.round(attr[:, :1], decimals=decimals).expand(attr.shape)
     else:
         # batch x seq_len x features
         attr = torch.round(attr, decimals=decimals)